@@ -1,20 +1,32 @@
+from typing import Dict, Union
 from uuid import UUID
 
 import pygame.event
 import pygame.locals
 import pygame.time
 import pygame.display
+import pygame.mixer
 from pygame import Vector2
 
 import game.utils
-from game.landscape import Landscape
+from game.landscape import Landscape, sweeps
 from game.player import Player
+from game.profiler import profiler
 from game.rendering import Renderer
 import game.assets
 import game.rendering
 
 class Game:
-    def __init__(self, renderer: Renderer, landscape: Landscape, *players: Player):
+
+    TICK_RATE = 120
+    MAX_CATCH_UP_STEPS = 5
+    def __init__(self, renderer: Union[Renderer, None], landscape: Landscape, *players: Player, tick_rate: int = TICK_RATE, max_catch_up_steps: int = MAX_CATCH_UP_STEPS):
+        """ If renderer is None, the game is headless and can only be advanced with step.
+
+        tick_rate is the number of physics steps per second of game time and
+        max_catch_up_steps caps the steps done in a single frame, when the game falls behind. """
+        assert tick_rate > 0
+        assert max_catch_up_steps > 0
         self.players = list(players)
         self.landscape = landscape
         self.running = True
@@ -22,10 +34,22 @@ class Game:
         self.start_millis = -1
         self.game_millis = -1
 
+        # The number of physics steps done, since the race started
+        self.tick = 0
+
+        # Records the turns of the players, if it is set (see game.replay)
+        self.replay = None
+
+        self.tick_rate = tick_rate
+        self.max_catch_up_steps = max_catch_up_steps
+
         self.renderer = renderer
+        self.headless = renderer is None
 
-        self.collision_sound = game.assets.get_sound('collision')
-        self.score_sound = game.assets.get_sound('score')
+        # A headless game doesn't need (nor has) a mixer to play sounds
+        has_sounds = not self.headless and pygame.mixer.get_init() is not None
+        self.collision_sound = game.assets.get_sound('collision') if has_sounds else None
+        self.score_sound = game.assets.get_sound('score') if has_sounds else None
 
     def add_player(self, player: Player):
         self.players.append(player)
@@ -33,72 +57,177 @@ class Game:
     def remove_player(self, uuid: UUID):
         for index, player in enumerate(self.players):
             if player.uuid == uuid:
-                player.keyboard.unlock()
+                if player.controller is not None:
+                    player.controller.release()
                 self.players.pop(index)
+
+                if player.pool is not None:
+                    player.pool.remove(player)
                 break
 
+    def get_pools(self):
+        """ Returns every PlayerPool that simulates players of this game. """
+        pools = []
+        for player in self.players:
+            if player.pool is not None and player.pool not in pools:
+                pools.append(player.pool)
+
+        return pools
+
     def get_main_player(self):
         return self.players[0]
 
+    def play_sound(self, sound: Union[game.assets.Sound, None]):
+        if sound is not None:
+            sound.play()
+
     def update(self, dt):
         self.game_millis = game.utils.current_millis() - self.start_millis
+        self.simulate(dt)
+
+    def step(self, dt: float, inputs: Union[Dict[UUID, int], None] = None) -> bool:
+        """ Advances the game by dt, without using the display, the mixer or the clock.
+
+        inputs maps the uuid of a player to the direction it turns to in this step (-1 for left and 1 for right).
+        Returns whether the game is still running. """
+        if inputs:
+            for index, player in enumerate(self.players):
+                direction = inputs.get(player.uuid, 0)
+                if direction != 0 and player.turn(direction) and self.replay is not None:
+                    self.replay.record(self.tick, index, direction)
+
+        # The controllers that don't wait for events (like bots) decide once per step
+        for index, player in enumerate(self.players):
+            if player.controller is not None:
+                direction = player.controller.decide(player)
+                if direction != 0 and player.turn(direction) and self.replay is not None:
+                    self.replay.record(self.tick, index, direction)
+
+        # The race starts as soon as the game is stepped, there is no countdown
+        self.game_millis = max(self.game_millis, 0) + dt / self.landscape.world.time_factor
+        self.simulate(dt)
+        self.tick += 1
 
+        return bool(self.running)
+
+    def simulate(self, dt):
+        """ Moves every player and handles its collisions with the landscape. """
+        self.landscape.update([player.pos for player in self.players])
+
+        # Pooled players are moved all at once by their pools,
+        # their update only catches up with the result
+        for pool in self.get_pools():
+            pool.update(dt)
+
+        landscape = self.landscape
+        tests = 0
         for player in self.players:
             player.update(dt)
 
+            # The collisions are checked along the whole path of the player since the last step,
+            # so that it can't go through an obstacle or a gate in a single (big) step
+            previous_box, box = player.previous_collision_box, player.collision_box
+            swept_box = previous_box.union(box)
+
             if player.time_since_last_collision >= Player.INVULN_TIME:
-                for tree in self.landscape.trees:
-                    if tree.collides_at(player.collision_box):
+                for tree_box in landscape.trees_near(swept_box):
+                    tests += 1
+                    if sweeps(tree_box, previous_box, box):
                         player.time_since_last_collision = 0
                         player.velocity = Vector2(0, 0)
-                        self.collision_sound.play()
+                        self.play_sound(self.collision_sound)
 
-            for pair in self.landscape.flag_pairs:
+            # The pairs are made only when they are hit or scored,
+            # no two pairs have the same y value, so it tells them apart
+            player.next_pair_index = landscape.advance_flag_cursor(player.next_pair_index, swept_box)
+            for index, gap_box, left_box, right_box in landscape.flag_pairs_near(swept_box, player.next_pair_index):
+                tests += 1
                 if player.time_since_last_collision >= Player.INVULN_TIME:
-                    if pair.left.collides_at(player.collision_box) or pair.right.collides_at(player.collision_box):
+                    if sweeps(left_box, previous_box, box) or sweeps(right_box, previous_box, box):
                         player.time_since_last_collision = 0
-                        player.last_scored_pair = pair
+                        player.last_scored_pair = landscape.flag_pairs[index]
                         player.velocity = Vector2(0,0)
-                        self.collision_sound.play()
+                        self.play_sound(self.collision_sound)
 
-                    if player.last_scored_pair != pair:
-                        if pair.collides_at(player.collision_box):
-                                player.last_scored_pair = pair
+                    if player.last_scored_pair is None or player.last_scored_pair.y != landscape.flag_pair_ys[index]:
+                        if sweeps(gap_box, previous_box, box):
+                                player.last_scored_pair = landscape.flag_pairs[index]
                                 player.score += 1
-                                self.score_sound.play()
+                                self.play_sound(self.score_sound)
 
-            if player.pos.y > self.landscape.world.height:
+            if player.pos.y > self.landscape.height:
                 self.running = False
 
+        profiler.count("collision_tests", tests)
+
     def start(self, millis = -1):
         """ This function will block the executing environment, until the game ends. """
+        assert self.renderer is not None, "A headless game can't be started, use step instead."
+
         self.start_millis = game.utils.current_millis() + 3000 if millis == -1 else millis
 
         clock = pygame.time.Clock()
         while self.running:
             clock.tick(60)
+
+            start = profiler.start()
             for event in pygame.event.get():
                 if event.type == pygame.locals.QUIT:
                     self.running = None
 
+                self.renderer.process_event(event)
+
+            profiler.stop("events", start)
+
+            start = profiler.start()
             self.update(0)
+            profiler.stop("update", start)
+
             self.renderer.render(self)
+            profiler.end_frame()
 
             if self.game_millis >= 0:
                 break
 
+        # The race starts at exactly 0, whatever the frame rate of the countdown was, so that it can be replayed
+        self.game_millis = 0
 
+        # The physics always advance in steps of tick_millis, no matter the frame rate.
+        # The time left in the accumulator is used to interpolate the players' positions.
+        tick_millis = 1000 / self.tick_rate
+        accumulator = 0.0
         while self.running:
-            dt = clock.tick(60) * self.landscape.world.time_factor
+            accumulator += clock.tick(60)
 
+            # The renderer measures the drawing and the flip itself
+            start = profiler.start()
             for event in pygame.event.get():
                 if event.type == pygame.locals.QUIT:
                     self.running = None
 
-                for player in self.players:
-                    player.process_event(event)
+                self.renderer.process_event(event)
+                for index, player in enumerate(self.players):
+                    direction = player.process_event(event)
+                    if direction != 0 and self.replay is not None:
+                        self.replay.record(self.tick, index, direction)
 
-            self.update(dt)
-            self.renderer.render(self)
+            profiler.stop("events", start)
+
+            start = profiler.start()
+            steps = 0
+            while self.running and accumulator >= tick_millis and steps < self.max_catch_up_steps:
+                self.step(tick_millis * self.landscape.world.time_factor)
+                accumulator -= tick_millis
+                steps += 1
+
+            # If we can't keep up, the game slows down instead of
+            # piling up steps for the next frames
+            accumulator = min(accumulator, tick_millis)
+
+            profiler.stop("update", start)
+            profiler.count("steps", steps)
+
+            self.renderer.render(self, accumulator / tick_millis)
+            profiler.end_frame()
 
         return self.running is not None
@@ -1,13 +1,29 @@
+""" Holds all logic related to loading the assets of the game
+
+Every image (and the flipped states of the skier) is packed into a single surface, the atlas,
+and the manifest maps the name of each image to the area of the atlas it is in.
+The atlas and the sounds can be decoded on a background thread (see preload),
+so that they are ready by the time the race starts.
+"""
+
 import os
-from typing import Dict, Tuple
+import threading
+from typing import Dict, Tuple, Union
 
 
+import pygame.display
 import pygame.image
 import pygame.font
 import pygame.mixer
-from pygame import Surface
+import pygame.transform
+from pygame import Rect, Surface
 
 FOLDER = os.path.join(os.path.dirname(__file__), '..', '..', 'assets')
+
+# The skier looks to the right when it turns right, so these are also stored flipped
+FLIPPED = ['skier-0', 'skier-1', 'skier-2', 'skier-3']
+FLIPPED_SUFFIX = '-flipped'
+
 class Image:
     def __init__(self, surface: Surface):
         self.surface = surface
@@ -21,52 +37,186 @@ class Sound(pygame.mixer.Sound):
     def __init__(self, path: str) -> None:
         super().__init__(path)
 
+class Atlas:
+    """ Packs many surfaces into a single one, in rows (shelves) from the tallest to the shortest """
+
+    WIDTH = 512
+    PADDING = 1
+
+    def __init__(self, surfaces: Dict[str, Surface]):
+        width = max([Atlas.WIDTH] + [surface.get_width() for surface in surfaces.values()])
+
+        self.manifest: Dict[str, Rect] = {}
+
+        x, y, shelf_height = 0, 0, 0
+        for name, surface in sorted(surfaces.items(), key=lambda item: (-item[1].get_height(), item[0])):
+            w, h = surface.get_size()
+            if x + w > width:
+                x, y = 0, y + shelf_height + Atlas.PADDING
+                shelf_height = 0
+
+            self.manifest[name] = Rect(x, y, w, h)
+
+            x += w + Atlas.PADDING
+            shelf_height = max(shelf_height, h)
+
+        self.surface = Surface((width, max(y + shelf_height, 1)), pygame.SRCALPHA)
+        self.surface.blits([(surfaces[name], rect) for name, rect in self.manifest.items()], doreturn=False)
+
+    def convert(self):
+        """ Converts the atlas to the format of the display, for faster blits. """
+        self.surface = self.surface.convert_alpha()
+
+    def get_images(self) -> Dict[str, Image]:
+        """ Returns an image for every area of the manifest, sharing the pixels of the atlas. """
+        return {name: Image(self.surface.subsurface(rect)) for name, rect in self.manifest.items()}
+
+class Preloader(threading.Thread):
+    """ Decodes the atlas and the sounds, without touching the display, which isn't thread-safe """
+    def __init__(self, sounds: bool):
+        super().__init__(name="assets-preloader", daemon=True)
+
+        self.load_sounds = sounds
+        self.atlas: Union[Atlas, None] = None
+        self.sounds: Dict[str, Sound] = {}
+        self.error: Union[BaseException, None] = None
+
+    def run(self):
+        try:
+            self.atlas = load_atlas()
+
+            if self.load_sounds:
+                for name in os.listdir(os.path.join(FOLDER, "sounds")):
+                    self.sounds[name] = Sound(os.path.join(FOLDER, "sounds", name)) # type: ignore
+        except BaseException as error:
+            self.error = error
+
 images: Dict[str, Image] = {}
 fonts: Dict[Tuple[str, int], Font] = {}
 sounds: Dict[str, Sound] = {}
 
-def get_image(name: str):
-    """ Loads an image from the assets folder. """
-    if '.' not in name:
-        name = name + '.png'
-
-    if name in images:
-        return images[name]
-
-    path = os.path.join(FOLDER, "images", name)
+atlas: Union[Atlas, None] = None
+preloader: Union[Preloader, None] = None
+
+def load_atlas() -> Atlas:
+    """ Decodes every image of the assets folder, with the flipped states of the skier, into an atlas. """
+    surfaces: Dict[str, Surface] = {}
+    for filename in os.listdir(os.path.join(FOLDER, "images")):
+        name, extension = os.path.splitext(filename)
+        if extension == '.png':
+            surfaces[name] = pygame.image.load(os.path.join(FOLDER, "images", filename))
+
+    for name in FLIPPED:
+        surfaces[name + FLIPPED_SUFFIX] = pygame.transform.flip(surfaces[name], True, False)
+
+    return Atlas(surfaces)
+
+def preload():
+    """ Starts decoding the assets on a background thread. The display should be set before
+    they are used, so they can be converted, which happens on the first lookup after this. """
+    global preloader
+    if preloader is None and atlas is None:
+        preloader = Preloader(pygame.mixer.get_init() is not None)
+        preloader.start()
+
+def wait():
+    """ Waits for the assets being preloaded, and makes them available to the lookups. """
+    global preloader
+    if preloader is None:
+        return
+
+    loader, preloader = preloader, None
+    loader.join()
+
+    if loader.error is not None:
+        raise loader.error
+
+    add_atlas(loader.atlas) # type: ignore
+    for name, sound in loader.sounds.items():
+        sounds.setdefault(name, sound)
+        sounds.setdefault(os.path.splitext(name)[0], sound)
+
+def add_atlas(new_atlas: Atlas):
+    """ Makes the images of the atlas available to get_image, both with and without their extension. """
+    global atlas
+    atlas = new_atlas
+
+    # Images can only be converted once there is a display,
+    # headless games use them as they are
+    if pygame.display.get_surface() is not None:
+        atlas.convert()
+
+    for name, image in atlas.get_images().items():
+        images[name] = image
+        images[name + '.png'] = image
+
+def get_image(name: str) -> Image:
+    """ Returns an image of the assets folder, loading it the first time it is needed. """
+    image = images.get(name)
+    if image is not None:
+        return image
+
+    if preloader is not None:
+        wait()
+        return get_image(name)
+
+    if name.endswith(FLIPPED_SUFFIX):
+        original = get_image(name[:-len(FLIPPED_SUFFIX)])
+        image = Image(pygame.transform.flip(original.surface, True, False))
+        images[name] = image
+        return image
+
+    filename = name
+    if '.' not in filename:
+        filename = filename + '.png'
+
+    path = os.path.join(FOLDER, "images", filename)
     img = pygame.image.load(path)
-    if img.get_alpha() is None:
-        img = img.convert()
-    else:
-        img = img.convert_alpha()
+
+    if pygame.display.get_surface() is not None:
+        if img.get_alpha() is None:
+            img = img.convert()
+        else:
+            img = img.convert_alpha()
 
     image = Image(img) # type: ignore
     images[name] = image
+    images[filename] = image
     return image
 
-def get_font(name: str, size: int):
-    """ Loads a font from the assets folder. """
-    if '.' not in name:
-        name = name + '.ttf'
+def get_font(name: str, size: int) -> Font:
+    """ Returns a font of the assets folder, loading it the first time it is needed. """
+    font = fonts.get((name, size))
+    if font is not None:
+        return font
 
-    if (name, size) in fonts:
-        return fonts[(name, size)]
+    filename = name
+    if '.' not in filename:
+        filename = filename + '.ttf'
 
-    path = os.path.join(FOLDER, "fonts", name)
+    path = os.path.join(FOLDER, "fonts", filename)
     font = Font(path, size)
     fonts[(name, size)] = font
+    fonts[(filename, size)] = font
     return font
 
-def get_sound(name: str):
-    """ Loads a sound from the assets folder. """
-    if '.' not in name:
-        name = name + '.ogg'
+def get_sound(name: str) -> Sound:
+    """ Returns a sound of the assets folder, loading it the first time it is needed. """
+    sound = sounds.get(name)
+    if sound is not None:
+        return sound
+
+    if preloader is not None:
+        wait()
+        return get_sound(name)
 
-    if name in sounds:
-        return sounds[name]
+    filename = name
+    if '.' not in filename:
+        filename = filename + '.ogg'
 
-    path = os.path.join(FOLDER, "sounds", name)
+    path = os.path.join(FOLDER, "sounds", filename)
 
     sound = Sound(path) # type: ignore
     sounds[name] = sound
+    sounds[filename] = sound
     return sound
@@ -0,0 +1,271 @@
+""" Runs many headless races with bots, spread over a pool of processes, to compare how
+different worlds play: how long the races take, how many gates are scored and how often the bots crash
+
+    python -m game.batch --seeds 100 --vary friction=0.3,0.4,0.5 --vary inclination=50,60 --output results.jsonl
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import sys
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, NamedTuple, Set, Tuple, Union
+
+from pygame import Vector2
+
+import game
+import game.player
+from game.bots import BotController
+from game.config import WorldConfig
+from game.landscape import LocalLandscape
+from game.modes import default_slalom_config
+from game.pool import PlayerPool, PooledPlayer
+
+# The settings that can be varied, and where they are in the parameters of a world
+SETTINGS: Dict[str, Tuple[str, Union[int, None]]] = {
+    "width": ("width", None),
+    "difficulty": ("difficulty", None),
+    "gravity": ("gravity", None),
+    "inclination": ("inclination", None),
+    "friction": ("friction", None),
+    "flags_start": ("flags", 0),
+    "flags_distance_in_between": ("flags", 1),
+    "flags_margin_horizontal": ("flags", 2),
+    "flags_spacing_vertical": ("flags", 3),
+    "trees_margin_to_flags": ("trees_margin_to_flags", None),
+    "flags_ammount": ("ammounts", 0),
+    "trees_ammount": ("ammounts", 1)
+}
+
+# Every missed gate adds this many milliseconds to the time of a skier, like in the game
+MISSED_GATE_PENALTY = 5000
+
+# A bot that hasn't finished after this many milliseconds of game time never will
+MAX_MILLIS = 5 * 60 * 1000
+
+# A course is given up after it was running this many times when a worker died
+MAX_ATTEMPTS = 3
+
+Settings = Dict[str, Union[int, float]]
+
+class Course(NamedTuple):
+    """ A race to run: the world, built from params with settings applied, the seed of its landscape and the number of bots """
+    index: int
+    params: Dict[str, Any]
+    settings: Settings
+    seed: int
+    bots: int
+
+def apply_settings(params: Dict[str, Any], settings: Settings) -> Dict[str, Any]:
+    """ Returns a copy of the parameters of a world, with the given settings changed. """
+    params = json.loads(json.dumps(params))
+    for name, value in settings.items():
+        key, index = SETTINGS[name]
+        if index is None:
+            params[key] = value
+        else:
+            params[key][index] = value
+
+    return params
+
+def get_courses(params: Dict[str, Any], variations: Dict[str, List[Union[int, float]]], seeds: int, bots: int) -> List[Course]:
+    """ Returns a course for every seed of every combination of the variations. """
+    names = sorted(variations)
+    courses = []
+    for values in itertools.product(*(variations[name] for name in names)):
+        settings = dict(zip(names, values))
+        for seed in range(seeds):
+            courses.append(Course(len(courses), apply_settings(params, settings), settings, seed, bots))
+
+    return courses
+
+def run_course(course: Course) -> Dict[str, Any]:
+    """ Runs a race, until every bot finishes, and returns how each of them did.
+    A time is None if the bot didn't finish. """
+    world = WorldConfig(course.params)
+    landscape = LocalLandscape(world, course.seed)
+    rng = random.Random(course.seed)
+
+    # Every bot lives in the same pool, so that they are all moved at once
+    pool = PlayerPool(landscape, max(course.bots, 1))
+    bots = [
+        PooledPlayer(pool, Vector2(rng.uniform(world.width / 4, world.width * 3 / 4), 0), Vector2(0, 0), controller=BotController(seed=rng.randrange(2 ** 32)))
+        for _ in range(course.bots)
+    ]
+    obj = game.Game(None, landscape, *bots)
+    dt = 1000 / obj.tick_rate * world.time_factor
+
+    times: List[Union[float, None]] = [None] * len(bots)
+    collisions = [0] * len(bots)
+    racing = len(bots)
+    while racing > 0 and obj.game_millis < MAX_MILLIS:
+        obj.step(dt)
+
+        for i, player in enumerate(bots):
+            if times[i] is not None:
+                continue
+
+            # A collision is the only thing that sets it back to 0
+            if player.time_since_last_collision == 0:
+                collisions[i] += 1
+
+            if player.pos.y > landscape.height:
+                times[i] = obj.game_millis
+                obj.remove_player(player.uuid)
+                racing -= 1
+
+    gates = [player.score for player in bots]
+    return {
+        "course": course.index,
+        "settings": course.settings,
+        "seed": course.seed,
+        "times": times,
+        "gates": gates,
+        "penalties": [(world.flags_ammount - score) * MISSED_GATE_PENALTY for score in gates],
+        "collisions": collisions
+    }
+
+# Where the worker tells which courses it starts, so that the ones that were running when it died are known
+started: Union[multiprocessing.SimpleQueue, None] = None
+
+def init_worker(starts: multiprocessing.SimpleQueue):
+    global started
+    started = starts
+    game.player.init()
+
+def run_started_course(course: Course) -> Dict[str, Any]:
+    assert started is not None
+
+    # Written right away (not by a thread), so that it isn't lost if the worker dies
+    started.put(course.index)
+    return run_course(course)
+
+def run_batch(courses: List[Course], workers: Union[int, None] = None, max_attempts: int = MAX_ATTEMPTS) -> Iterator[Dict[str, Any]]:
+    """ Runs the courses over a pool of worker processes, yielding the result of each one as soon as it finishes.
+
+    If a worker dies, the pool is replaced and the courses that didn't finish are run again.
+    The ones that were running when it died are run first, one at a time, to find the one to blame.
+    A course that was running every time a worker died (max_attempts times) is yielded as an error instead,
+    as is a course that raises an exception. """
+    assert max_attempts > 0
+
+    attempts: Dict[int, int] = {}
+    remaining = {course.index: course for course in courses}
+    while remaining:
+        suspects = [course for course in remaining.values() if course.index in attempts]
+        batch = suspects or list(remaining.values())
+
+        starts = multiprocessing.SimpleQueue()
+        executor = ProcessPoolExecutor(1 if suspects else workers, initializer=init_worker, initargs=(starts,))
+        futures: Dict[Future, Course] = {executor.submit(run_started_course, course): course for course in batch}
+        pending: Set[Future] = set(futures)
+        broken = False
+        try:
+            # After a worker dies, every future that is left fails right away
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    course = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        broken = True
+                        continue
+                    except Exception as error:
+                        result = {"course": course.index, "settings": course.settings, "seed": course.seed, "error": repr(error)}
+
+                    del remaining[course.index]
+                    yield result
+        finally:
+            executor.shutdown(wait=not broken, cancel_futures=True)
+
+        if not broken:
+            continue
+
+        # Only the courses that were running when the worker died are to blame
+        running: Set[int] = set()
+        while not starts.empty():
+            running.add(starts.get())
+
+        for index in running & remaining.keys():
+            attempts[index] = attempts.get(index, 0) + 1
+            if attempts[index] >= max_attempts:
+                course = remaining.pop(index)
+                yield {"course": course.index, "settings": course.settings, "seed": course.seed, "error": "a worker died while running it"}
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def summarize(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """ Returns the statistics of the results of every combination of settings. """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for result in results:
+        groups.setdefault(json.dumps(result["settings"], sort_keys=True), []).append(result)
+
+    summaries = []
+    for key, group in groups.items():
+        races = [result for result in group if "error" not in result]
+        times = [time for result in races for time in result["times"] if time is not None]
+        totals = [time + penalty for result in races for time, penalty in zip(result["times"], result["penalties"]) if time is not None]
+        skiers = sum(len(result["times"]) for result in races)
+
+        summary: Dict[str, Any] = {"settings": json.loads(key), "races": len(races), "errors": len(group) - len(races)}
+        if skiers > 0:
+            summary["finished"] = len(times) / skiers
+            summary["gates"] = sum(sum(result["gates"]) for result in races) / skiers
+            summary["collisions"] = sum(sum(result["collisions"]) for result in races) / skiers
+
+        if times:
+            summary["time_mean"] = sum(times) / len(times)
+            summary["time_p50"] = percentile(times, 0.5)
+            summary["time_p90"] = percentile(times, 0.9)
+            summary["total_mean"] = sum(totals) / len(totals)
+
+        summaries.append(summary)
+
+    return summaries
+
+def parse_variation(text: str) -> Tuple[str, List[Union[int, float]]]:
+    """ Parses a variation given as name=value,value,... """
+    name, _, values = text.partition('=')
+    if name not in SETTINGS or not values:
+        raise argparse.ArgumentTypeError(f"expected one of {', '.join(SETTINGS)}, followed by =values")
+
+    return name, [json.loads(value) for value in values.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs many races with bots, in parallel, and compares how different worlds play.")
+    parser.add_argument('--vary', type=parse_variation, action='append', default=[], metavar='NAME=VALUES', help="the values a setting takes, separated by commas")
+    parser.add_argument('--seeds', type=int, default=20, help="how many landscapes are raced for every combination of settings")
+    parser.add_argument('--bots', type=int, default=4, help="how many bots race in every landscape")
+    parser.add_argument('--workers', type=int, help="how many processes run the races (as many as there are cores by default)")
+    parser.add_argument('--output', metavar='PATH', help="appends the result of every race to this file, as a JSON line, as soon as it finishes")
+    args = parser.parse_args()
+
+    courses = get_courses(default_slalom_config.params, dict(args.vary), args.seeds, args.bots)
+
+    output = open(args.output, 'a') if args.output is not None else None
+    results = []
+    try:
+        for result in run_batch(courses, args.workers):
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+
+            print(f"\r{len(results)}/{len(courses)} races", end='', file=sys.stderr, flush=True)
+    finally:
+        print(file=sys.stderr)
+        if output is not None:
+            output.close()
+
+    for summary in summarize(results):
+        settings = ' '.join(f"{name}={value}" for name, value in summary.pop("settings").items()) or "default"
+        print(settings, json.dumps(summary))
+
+if __name__ == '__main__':
+    main()
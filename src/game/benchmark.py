@@ -0,0 +1,279 @@
+""" Measures the hot paths of the game (generating landscapes, simulating and rendering races),
+with fixed seeds, and compares the results with the ones of a previous run
+
+    python -m game.benchmark --output results.json
+    python -m game.benchmark --compare results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple, Union
+
+import pygame
+import pygame.display
+import pygame.font
+from pygame import Vector2
+
+import game
+import game.player
+from game.bots import BotController
+from game.config import WorldConfig
+from game.landscape import LocalLandscape
+from game.player import Player
+from game.pool import PlayerPool, PooledPlayer
+from game.rendering import Renderer, SplitScreenRenderer
+
+SEED = 2021
+
+TREE_COUNTS = [40, 1000, 10000, 100000]
+PLAYER_COUNTS = [1, 4, 16, 64, 256]
+RENDERED_PLAYER_COUNTS = [1, 4, 16]
+BOT_COUNTS = [16, 256]
+VIEWPORT_COUNTS = [2, 4]
+
+Operation = Callable[[], None]
+
+class BenchmarkPlayer(Player):
+    """ A player turned by the benchmark, instead of a keyboard """
+    uses_keyboard = False
+
+class PooledBenchmarkPlayer(PooledPlayer):
+    """ A player turned by the benchmark, that lives in a pool """
+    uses_keyboard = False
+
+def new_world(trees: int, flags: int = 20, height: Union[int, None] = None) -> WorldConfig:
+    # There are about 30 pixels of slope for every tree, so that they fit with room to spare
+    return WorldConfig.builder() \
+        .set_width(800) \
+        .set_height(height or max(30 * trees, 6000)) \
+        .set_difficulty(1) \
+        .set_gravity(100) \
+        .set_inclination(60) \
+        .set_friction(0.4) \
+        .set_flags_start(300) \
+        .set_distance_between_flags(200) \
+        .set_flags_margin_horizontal(100) \
+        .set_flags_margin_vertical(250) \
+        .set_trees_margin_to_flags(50) \
+        .set_flags_ammount(flags) \
+        .set_trees_ammount(trees) \
+        .build()
+
+def generation(trees: int) -> Operation:
+    """ Generates a landscape with the given number of trees. """
+    world = new_world(trees)
+
+    def generate():
+        LocalLandscape(world, SEED)
+
+    return generate
+
+def new_race(players: int, renderer: Union[Renderer, None] = None, bots: bool = False, pooled: bool = False) -> Tuple['game.Game', Operation]:
+    """ Returns a race in a crowded landscape and a function that advances it by a tick. The players turn at random
+    (or steer themselves, if they are bots), and go back to the top once they reach the bottom, so that the race never ends.
+    If pooled, the players live in a single PlayerPool. """
+    landscape = LocalLandscape(new_world(400, height=12000), SEED)
+    rng = random.Random(SEED)
+    pool = PlayerPool(landscape, players) if pooled else None
+
+    def new_player(i: int) -> Player:
+        pos = Vector2(rng.uniform(50, 750), rng.uniform(0, 200))
+        controller = BotController(seed=i) if bots else None
+        if pool is not None:
+            return PooledBenchmarkPlayer(pool, pos, Vector2(0, 0), controller=controller)
+
+        return BenchmarkPlayer(landscape, pos, Vector2(0, 0), controller=controller)
+
+    skiers = [new_player(i) for i in range(players)]
+    obj = game.Game(renderer, landscape, *skiers)
+    dt = 1000 / obj.tick_rate * landscape.world.time_factor
+
+    def tick():
+        inputs = {}
+        for player in skiers:
+            if not bots and rng.random() < 0.02:
+                inputs[player.uuid] = rng.choice((-1, 1))
+
+            if player.pos.y > landscape.height:
+                player.pos = Vector2(player.pos.x, 0)
+                player.reset_collision_box()
+
+        obj.step(dt, inputs)
+        obj.running = True
+
+    return obj, tick
+
+def simulation(players: int) -> Operation:
+    """ Advances a race with the given number of players by a tick. """
+    _, tick = new_race(players)
+    return tick
+
+def pool_simulation(players: int) -> Operation:
+    """ Advances a race with the given number of players, that live in a pool, by a tick. """
+    _, tick = new_race(players, pooled=True)
+    return tick
+
+def bot_simulation(players: int) -> Operation:
+    """ Advances a race with the given number of bots by a tick, the bots decide where to turn. """
+    _, tick = new_race(players, bots=True)
+    return tick
+
+def rendering(players: int) -> Operation:
+    """ Draws a frame of a race with the given number of players. """
+    renderer = Renderer(pygame.display.get_surface())
+    obj, tick = new_race(players, renderer)
+
+    def frame():
+        tick()
+        renderer.render(obj)
+
+    return frame
+
+def split_rendering(viewports: int) -> Operation:
+    """ Draws a frame of a race split into a viewport for each of its players. """
+    renderer = SplitScreenRenderer(pygame.display.get_surface(), viewports)
+    obj, tick = new_race(viewports, renderer)
+
+    def frame():
+        tick()
+        renderer.render(obj)
+
+    return frame
+
+def check_dirty_rects(players: int = 3, ticks: int = 1500, frame_ticks: int = 3) -> Tuple[List[int], int]:
+    """ Draws the same race (a frame every frame_ticks ticks) redrawing every frame and redrawing only the dirty rects.
+    Returns the frames that differ and the number of collisions, the players turn at random so they crash along the way. """
+    screen = pygame.display.get_surface()
+    frames: List[List[bytes]] = []
+    collisions = 0
+    for dirty in (False, True):
+        renderer = Renderer(screen)
+        renderer.set_dirty_rects(dirty)
+        obj, tick = new_race(players, renderer)
+
+        frames.append([])
+        collisions = 0
+        for i in range(ticks):
+            tick()
+            collisions += sum(1 for player in obj.players if player.time_since_last_collision == 0)
+            if i % frame_ticks == 0:
+                renderer.render(obj)
+                frames[-1].append(pygame.image.tobytes(screen, 'RGB'))
+
+    return [i for i, (full, dirty) in enumerate(zip(*frames)) if full != dirty], collisions
+
+def get_benchmarks(quick: bool = False) -> List[Tuple[str, Callable[[], Operation]]]:
+    """ Returns the name and the setup of every benchmark. The setup returns the operation that is measured. """
+    tree_counts = TREE_COUNTS[:-1] if quick else TREE_COUNTS
+    return [(f"generation/trees={trees}", lambda trees=trees: generation(trees)) for trees in tree_counts] + \
+        [(f"simulation/players={players}", lambda players=players: simulation(players)) for players in PLAYER_COUNTS] + \
+        [(f"simulation/pool={players}", lambda players=players: pool_simulation(players)) for players in PLAYER_COUNTS] + \
+        [(f"simulation/bots={players}", lambda players=players: bot_simulation(players)) for players in BOT_COUNTS] + \
+        [(f"rendering/players={players}", lambda players=players: rendering(players)) for players in RENDERED_PLAYER_COUNTS] + \
+        [(f"rendering/split={viewports}", lambda viewports=viewports: split_rendering(viewports)) for viewports in VIEWPORT_COUNTS]
+
+def measure(setup: Callable[[], Operation], min_time: float = 1, min_ops: int = 5, memory_ops: int = 3) -> Dict[str, float]:
+    """ Runs the operation until both min_time seconds and min_ops operations have passed.
+    The peak memory is the one of the next memory_ops operations. """
+    operation = setup()
+    operation() # warm up
+
+    durations: List[int] = []
+    start = time.perf_counter_ns()
+    while len(durations) < min_ops or time.perf_counter_ns() - start < min_time * 1e9:
+        before = time.perf_counter_ns()
+        operation()
+        durations.append(time.perf_counter_ns() - before)
+
+    # The memory is measured apart, tracing slows down everything else.
+    # Only the operations are traced, the setup (like generating a landscape to race in) isn't
+    tracemalloc.start()
+    try:
+        for _ in range(memory_ops):
+            operation()
+
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    durations.sort()
+    return {
+        "ops": len(durations),
+        "ops_per_sec": len(durations) / (sum(durations) / 1e9),
+        "p50_ms": durations[len(durations) // 2] / 1e6,
+        "p99_ms": durations[min(int(len(durations) * 0.99), len(durations) - 1)] / 1e6,
+        "peak_kib": peak / 1024
+    }
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> List[str]:
+    """ Returns the benchmarks that are slower than in the baseline, by more than threshold (a fraction). """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is not None and result["ops_per_sec"] < base["ops_per_sec"] * (1 - threshold):
+            regressions.append(name)
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the hot paths of the game.")
+    parser.add_argument('--output', metavar='PATH', help="saves the results as JSON")
+    parser.add_argument('--compare', metavar='PATH', help="fails if a benchmark is slower than in these results")
+    parser.add_argument('--threshold', type=float, default=0.15, help="how much slower (a fraction) is a regression")
+    parser.add_argument('--only', metavar='TEXT', help="only runs the benchmarks whose name has this text")
+    parser.add_argument('--min-time', type=float, default=1, help="seconds to measure each benchmark for")
+    parser.add_argument('--quick', action='store_true', help="skips the biggest landscape")
+    parser.add_argument('--check', action='store_true', help="fails if drawing only the dirty rects gives other frames than redrawing everything")
+    args = parser.parse_args()
+
+    # The renderer needs a display, but not a window
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.font.init()
+    pygame.display.set_mode((800, 600))
+    game.player.init()
+
+    if args.check:
+        differ, collisions = check_dirty_rects()
+        print(f"dirty rects: {len(differ)} frames differ, over a race with {collisions} collisions", flush=True)
+        if differ:
+            print(f"the first one is frame {differ[0]}")
+            sys.exit(1)
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name, setup in get_benchmarks(args.quick):
+        if args.only is not None and args.only not in name:
+            continue
+
+        result = measure(setup, args.min_time)
+        results[name] = result
+        print(f"{name:<28} {result['ops_per_sec']:>12.1f} ops/s  p50 {result['p50_ms']:>9.3f} ms  p99 {result['p99_ms']:>9.3f} ms  peak {result['peak_kib']:>10.0f} KiB", flush=True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({
+                "python": platform.python_version(),
+                "pygame": pygame.version.ver,
+                "platform": platform.platform(),
+                "results": results
+            }, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)["results"]
+
+        regressions = compare(results, baseline, args.threshold)
+        for name in regressions:
+            print(f"{name} is slower: {results[name]['ops_per_sec']:.1f} ops/s, it was {baseline[name]['ops_per_sec']:.1f} ops/s")
+
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
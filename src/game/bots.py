@@ -0,0 +1,117 @@
+""" Holds the bots: controllers that ski on their own, through the gates and around the trees,
+so that races can be filled with opponents (or with load) without keyboards """
+
+import math
+import random
+from bisect import bisect_left, bisect_right
+from typing import List, Tuple, Union
+
+from pygame import Rect, Vector2
+
+from game.landscape import Landscape, Tree
+from game.player import Controller, Player
+
+class BotController(Controller):
+    """ Steers its player toward the gap of the next flag pair, going around the first tree in the way.
+    A decision only looks at the next pair and at the trees a short distance ahead,
+    so it takes about the same time no matter how big the landscape is. """
+
+    # How far ahead (in pixels) the bot looks for trees in its way
+    LOOKAHEAD = 150
+
+    # The room (in pixels) the bot leaves between itself and the trees
+    MARGIN = 10
+
+    # Skiing sideways only slows the player down, so the bot never turns further than this
+    MAX_ANGLE = 60
+
+    # The angle (in degrees) the wanted direction has to go past the middle between two states by,
+    # before the bot turns, so that it doesn't turn back and forth around the middle
+    DEAD_ZONE = 5
+
+    # The ticks between two decisions, nobody turns on every tick
+    REACTION_TICKS = 4
+    def __init__(self, reaction_ticks: int = REACTION_TICKS, seed: Union[int, str, None] = None):
+        assert reaction_ticks > 0
+
+        self.reaction_ticks = reaction_ticks
+
+        # The bots decide on different ticks, so that the work is spread over them
+        self.cooldown = random.Random(seed).randrange(reaction_ticks)
+
+    def decide(self, player: Player) -> int:
+        if self.cooldown > 0:
+            self.cooldown -= 1
+            return 0
+
+        self.cooldown = self.reaction_ticks - 1
+        if player.time_since_last_collision < Player.DOWN_TIME:
+            return 0
+
+        x, y = self.target(player)
+        dy = y - player.pos.y
+        angle = math.degrees(math.atan2(x - player.pos.x, dy if dy > 1 else 1))
+        angle = max(-BotController.MAX_ANGLE, min(angle, BotController.MAX_ANGLE))
+
+        # The states are sorted by angle, the player turns if the angle is closer to the next state on either side (by DEAD_ZONE)
+        states = Player.get_states()
+        state = player.state
+        current = states[state][0]
+
+        if state + 1 < len(states) and angle > (current + states[state + 1][0]) / 2 + BotController.DEAD_ZONE:
+            return 1
+        elif state > 0 and angle < (current + states[state - 1][0]) / 2 - BotController.DEAD_ZONE:
+            return -1
+
+        return 0
+
+    def target(self, player: Player) -> Tuple[float, float]:
+        """ Returns the point the player should ski to. """
+        landscape = player.landscape
+        box = player.collision_box
+
+        # The gap of the first pair that is still ahead, or straight down to the finish
+        x, y = player.pos.x, float(landscape.height)
+        for i in range(player.next_pair_index, len(landscape.flag_pairs)):
+            pair = landscape.flag_pairs[i]
+            if pair.y > box.bottom:
+                x, y = pair.collision_box.centerx, pair.y
+                break
+
+        tree = self.tree_in_way(landscape, player, x, y)
+        if tree is not None:
+            # The side of the tree closer to where the player is going
+            half_width = box.width / 2 + BotController.MARGIN
+            left = tree.left - half_width
+            right = tree.right + half_width
+            if left < half_width or (right <= landscape.width - half_width and abs(right - x) < abs(left - x)):
+                return right, tree.bottom
+
+            return left, tree.bottom
+
+        return x, y
+
+    def tree_in_way(self, landscape: Landscape, player: Player, x: float, y: float) -> Union[Rect, None]:
+        """ Returns the collision box of the nearest tree on the straight line from the player to (x, y), if there is one. """
+        pos = player.pos
+        box = player.collision_box
+        reach = box.width / 2 + BotController.MARGIN
+
+        # The trees are sorted by the bottom of their collision boxes
+        bottoms: List[int] = landscape.tree_bottoms
+        start = bisect_right(bottoms, box.top)
+        end = bisect_left(bottoms, min(pos.y + BotController.LOOKAHEAD, y), start)
+
+        # The collision box is only made for the tree in the way, the others are checked straight from the columns
+        xs = landscape.tree_xs
+        width = Tree.get_size()[0]
+        direction = Vector2(x - pos.x, y - pos.y)
+        for i in range(start, end):
+            left = xs[i] - width // 2
+
+            # Where the player will be, horizontally, when it reaches the tree
+            path_x = pos.x + direction.x * (bottoms[i] - pos.y) / direction.y if direction.y > 0 else pos.x
+            if left - reach < path_x < left + width + reach:
+                return landscape.tree_collision_box(i)
+
+        return None
@@ -1,7 +1,11 @@
 """ Holds all logic related to the game's camera (the player's perspective) """
 
-from pygame import Vector2, Surface
+from itertools import islice
+from typing import List
 
+from pygame import Surface
+
+from game.profiler import profiler
 from game.types import Number, Vector
 
 class Camera:
@@ -12,11 +16,43 @@ class Camera:
         self.padding = padding
         self.offset = 0
 
+        # Only moves when the screen is narrower than the landscape (see track_x)
+        self.offset_x = 0
+
+        # The blits waiting to be drawn, as [surface, [x, y]] entries that are reused every frame
+        self.queue: List[list] = []
+        self.queued = 0
+
     def track(self, pos: Vector):
-        self.offset = -pos[1] + min(pos[1] + self.padding, self.top)
+        # The offset is kept in whole pixels, so that everything scrolls by the same amount
+        self.offset = round(-pos[1] + min(pos[1] + self.padding, self.top))
+
+    def track_x(self, x: Number, width: Number):
+        """ Keeps x in the middle of the screen, without showing anything outside of [0, width]. """
+        view_width = self.screen.get_width()
+        self.offset_x = -round(max(min(x - view_width / 2, width - view_width), 0))
 
     def transform(self, vector: Vector):
-        return Vector2(vector[0], vector[1] + self.offset)
+        return (vector[0] + self.offset_x, vector[1] + self.offset)
 
     def blit(self, surface: Surface, dest: Vector):
         return self.screen.blit(surface, self.transform(dest))
+
+    def enqueue(self, surface: Surface, dest: Vector):
+        """ Adds a blit to the queue, it is only drawn when the queue is flushed. """
+        if self.queued == len(self.queue):
+            self.queue.append([None, [0, 0]])
+
+        entry = self.queue[self.queued]
+        entry[0] = surface
+        entry[1][0] = dest[0] + self.offset_x
+        entry[1][1] = dest[1] + self.offset
+
+        self.queued += 1
+
+    def flush(self):
+        """ Draws every queued blit, in order, with a single call. """
+        if self.queued > 0:
+            self.screen.blits(islice(self.queue, self.queued), doreturn=False)
+            profiler.count("blits", self.queued)
+            self.queued = 0
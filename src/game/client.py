@@ -0,0 +1,369 @@
+""" Holds the multiplayer client: it predicts its own player with the same physics as the server,
+corrects it with the snapshots of the server and shows the other players between the snapshots it received """
+
+import asyncio
+import random
+from typing import Dict, List, Tuple, Union
+
+import pygame.event
+import pygame.locals
+from pygame import Vector2
+from pygame.event import Event
+
+import game
+import game.assets
+import game.protocol as protocol
+from game.config import WorldConfig
+from game.landscape import LocalLandscape
+from game.player import Keyboard, Player
+from game.protocol import Input, PlayerState, Snapshot
+from game.server import Address, GameServer
+
+class Link:
+    """ Simulates the network between a client and the server, by delaying (latency plus up to jitter, in seconds)
+    and dropping (with probability loss) the datagrams that go through it, in both directions """
+    def __init__(self, latency: float = 0, jitter: float = 0, loss: float = 0, seed: Union[int, str, None] = None):
+        assert latency >= 0 and jitter >= 0
+        assert 0 <= loss < 1
+
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+
+    def transmit(self, callback, *args):
+        """ Calls back with the args, once the datagram gets through, if it does. """
+        if self.loss > 0 and self.rng.random() < self.loss:
+            return
+
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter > 0 else 0)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, callback, *args)
+        else:
+            callback(*args)
+
+class PredictedPlayer(Player):
+    """ The player of a client, moved ahead of the server with its inputs """
+    uses_keyboard = False
+
+class RemotePlayer(Player):
+    """ A player of another client, only shown where the snapshots of the server place it """
+    uses_keyboard = False
+
+    def update(self, dt: float):
+        pass # The client moves it, between the snapshots
+
+    def show(self, before: PlayerState, after: PlayerState, alpha: float):
+        """ Places the player between two of its states, alpha is how far it is from before (0) to after (1). """
+        self.previous_pos.update(self.pos)
+
+        after.restore(self, self.landscape)
+        if before is not after:
+            self.pos = Vector2(before.x, before.y).lerp(Vector2(after.x, after.y), alpha) / protocol.QUANTUM
+            self.rect.center = (int(self.pos.x), int(self.pos.y))
+
+class GameClient(asyncio.DatagramProtocol):
+    """ Joins a race of a GameServer. It can be used as the game of a Renderer, with the client's player as the main player. """
+
+    JOIN_INTERVAL = 0.25
+    JOIN_TIMEOUT = 5
+
+    # How far behind the server (in ticks) the other players are shown,
+    # so that there is (most of the time) a snapshot after them to interpolate to
+    INTERPOLATION_DELAY = 6
+    MAX_CATCH_UP_STEPS = 5
+
+    # How many snapshots are kept, as baselines and to interpolate between
+    HISTORY = GameServer.HISTORY
+    MAX_SENT_INPUTS = 32
+    def __init__(self, keyboard: Union[Keyboard, None] = None, link: Union[Link, None] = None):
+        self.keyboard = keyboard
+        self.link = link or Link()
+
+        self.transport: Union[asyncio.DatagramTransport, None] = None
+        self.welcome: Union[asyncio.Future, None] = None
+        self.running = False
+        self.ended = False
+
+        self.id = -1
+        self.tick_rate = GameServer.TICK_RATE
+        self.world: Union[WorldConfig, None] = None
+        self.landscape: Union[LocalLandscape, None] = None
+        self.game: Union[game.Game, None] = None
+        self.player: Union[PredictedPlayer, None] = None
+
+        # Kept out of the game, so that the ticks replayed by reconcile stay silent (see step)
+        self.collision_sound: Union[game.assets.Sound, None] = None
+        self.score_sound: Union[game.assets.Sound, None] = None
+
+        self.players: List[Player] = []
+        self.remote_players: Dict[int, RemotePlayer] = {}
+        self.game_millis = -1
+
+        # The client runs lead ticks ahead of the server, so that its inputs get there in time
+        self.tick = 0
+        self.lead = 0
+        self.synced = False
+
+        self.snapshots: Dict[int, Snapshot] = {}
+        self.latest: Union[Snapshot, None] = None
+
+        # Every input that the server didn't apply yet, and the ones the client didn't apply yet either
+        self.sequence = 0
+        self.inputs: List[Input] = []
+        self.queue: List[Input] = []
+
+    async def connect(self, address: Address, timeout: float = JOIN_TIMEOUT):
+        """ Joins the race of the server at the given address, and builds its landscape. """
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, remote_addr=address)
+
+        self.welcome = loop.create_future()
+        start = loop.time()
+        while True:
+            sent = loop.time()
+            self.send(protocol.encode_join())
+            try:
+                id, uuid, tick_rate, seed, params = await asyncio.wait_for(asyncio.shield(self.welcome), GameClient.JOIN_INTERVAL)
+                break
+            except asyncio.TimeoutError:
+                if loop.time() - start > timeout:
+                    self.close()
+                    raise ConnectionError(f"The server at {address[0]}:{address[1]} didn't answer.")
+
+        # The inputs need half a round trip to get to the server, plus some margin
+        round_trip = loop.time() - sent
+        self.lead = int(round_trip / 2 * tick_rate) + 2
+
+        self.id = id
+        self.tick_rate = tick_rate
+        self.world = WorldConfig(params)
+        self.landscape = LocalLandscape(self.world, seed)
+
+        self.player = PredictedPlayer(self.landscape, Vector2(self.world.width / 2, 0), Vector2(0, 0), uuid)
+        self.players = [self.player]
+
+        # The predictions are silent, the sounds are played once they are not replayed anymore
+        self.game = game.Game(None, self.landscape, self.player, tick_rate=tick_rate)
+        self.running = True
+
+    def close(self):
+        self.running = False
+        if self.transport is not None:
+            self.transport.sendto(protocol.encode_leave())
+            self.transport.close()
+            self.transport = None
+
+    def get_main_player(self) -> Player:
+        assert self.player is not None
+        return self.player
+
+    def send(self, data: bytes):
+        self.link.transmit(self.__send_now, data)
+
+    def __send_now(self, data: bytes):
+        if self.transport is not None:
+            self.transport.sendto(data)
+
+    def connection_made(self, transport):
+        self.transport = transport # type: ignore
+
+    def datagram_received(self, data: bytes, address: Address):
+        self.link.transmit(self.receive, data)
+
+    def receive(self, data: bytes):
+        try:
+            kind = data[0]
+            if kind == protocol.WELCOME:
+                if self.welcome is not None and not self.welcome.done():
+                    self.welcome.set_result(protocol.decode_welcome(data))
+
+            elif kind == protocol.REJECT:
+                if self.welcome is not None and not self.welcome.done():
+                    self.welcome.set_exception(ConnectionError("The race is full."))
+
+            elif kind == protocol.SNAPSHOT and self.game is not None:
+                decoded = protocol.decode_snapshot(data, self.snapshots)
+                if decoded is not None:
+                    self.receive_snapshot(*decoded)
+        except (IndexError, ValueError):
+            pass # Malformed datagrams are dropped
+
+    def turn(self, direction: int):
+        """ Turns the client's player to the left (direction < 0) or to the right (direction > 0), as soon as possible. """
+        if not self.running or direction == 0:
+            return
+
+        # Each tick takes a single input, on both ends
+        tick = max(self.tick, self.queue[-1][1] + 1 if self.queue else 0)
+        self.sequence += 1
+
+        input = (self.sequence, tick, 1 if direction > 0 else -1)
+        self.inputs.append(input)
+        self.queue.append(input)
+
+    def process_event(self, event: Event):
+        if self.keyboard is None:
+            return
+
+        if self.keyboard.is_turning_left(event):
+            self.turn(-1)
+        elif self.keyboard.is_turning_right(event):
+            self.turn(1)
+
+    def receive_snapshot(self, snapshot: Snapshot, last_sequence: int):
+        self.snapshots[snapshot.tick] = snapshot
+        self.snapshots.pop(snapshot.tick - GameClient.HISTORY, None)
+
+        if self.latest is not None and snapshot.tick <= self.latest.tick:
+            return # Older than what is already known, only useful as a baseline
+
+        self.latest = snapshot
+        self.inputs = [input for input in self.inputs if input[0] > last_sequence]
+
+        if not self.synced or snapshot.tick > self.tick:
+            self.tick = snapshot.tick + self.lead
+            self.synced = True
+
+        self.reconcile(snapshot)
+        self.update_remote_players(snapshot)
+
+        if snapshot.ended:
+            self.ended = True
+            self.running = False
+
+    def reconcile(self, snapshot: Snapshot):
+        """ Puts the client's player where the server says it was, and replays the inputs the server didn't apply yet, up to the current tick. """
+        assert self.game is not None and self.player is not None and self.landscape is not None
+
+        state = snapshot.players.get(self.id)
+        if state is None:
+            return
+
+        state.restore(self.player, self.landscape)
+
+        # The server applies the inputs it has, one per tick, as soon as their tick comes
+        self.queue = list(self.inputs)
+        for tick in range(snapshot.tick, self.tick):
+            self.simulate(tick)
+
+        self.game.game_millis = self.tick * 1000 / self.tick_rate
+
+    def simulate(self, tick: int):
+        assert self.game is not None and self.player is not None
+
+        inputs = None
+        if self.queue and self.queue[0][1] <= tick:
+            _, _, direction = self.queue.pop(0)
+            inputs = {self.player.uuid: direction}
+
+        self.game.step(1000 / self.tick_rate * self.landscape.world.time_factor, inputs) # type: ignore
+
+    def update_remote_players(self, snapshot: Snapshot):
+        assert self.landscape is not None
+
+        for id in list(self.remote_players):
+            if id not in snapshot.players:
+                self.players.remove(self.remote_players.pop(id))
+
+        for id, uuid in snapshot.uuids.items():
+            if id != self.id and id not in self.remote_players:
+                player = RemotePlayer(self.landscape, Vector2(0, 0), Vector2(0, 0), uuid)
+                self.remote_players[id] = player
+                self.players.append(player)
+
+    def show_remote_players(self):
+        """ Places the other players where they were INTERPOLATION_DELAY ticks before the last snapshot the server sent. """
+        if self.latest is None:
+            return
+
+        tick = self.tick - self.lead - GameClient.INTERPOLATION_DELAY
+        ticks = sorted(self.snapshots)
+        for id, player in self.remote_players.items():
+            before: Union[Tuple[int, PlayerState], None] = None
+            after: Union[Tuple[int, PlayerState], None] = None
+            for t in ticks:
+                state = self.snapshots[t].players.get(id)
+                if state is None:
+                    continue
+
+                if t <= tick:
+                    before = (t, state)
+                else:
+                    after = (t, state)
+                    break
+
+            if before is None and after is None:
+                continue
+
+            if before is None or after is None:
+                # Not enough snapshots, the player stays at the closest one
+                _, state = before or after # type: ignore
+                player.show(state, state, 1)
+            else:
+                player.show(before[1], after[1], (tick - before[0]) / (after[0] - before[0]))
+
+    def step(self):
+        """ Advances the client's player by a tick, with its inputs, and sends them to the server. """
+        if not self.running or not self.synced:
+            if self.running:
+                self.send(protocol.encode_input(None, []))
+            return
+
+        assert self.game is not None and self.player is not None
+        score, down = self.player.score, self.player.time_since_last_collision
+
+        self.simulate(self.tick)
+        self.tick += 1
+        self.game.game_millis = self.tick * 1000 / self.tick_rate
+        self.game_millis = self.game.game_millis
+
+        if self.player.time_since_last_collision < down:
+            self.game.play_sound(self.collision_sound)
+        if self.player.score > score:
+            self.game.play_sound(self.score_sound)
+
+        self.show_remote_players()
+        self.send(protocol.encode_input(self.latest.tick if self.latest is not None else None, self.inputs[-GameClient.MAX_SENT_INPUTS:]))
+
+    async def run(self, renderer=None):
+        """ Runs the client until the race ends, showing it with the renderer, if there is one. """
+        loop = asyncio.get_running_loop()
+        tick_seconds = 1 / self.tick_rate
+        next_time = loop.time()
+
+        if renderer is not None:
+            self.collision_sound = game.assets.get_sound('collision')
+            self.score_sound = game.assets.get_sound('score')
+
+        while self.running:
+            now = loop.time()
+
+            if renderer is not None:
+                for event in pygame.event.get():
+                    if event.type == pygame.locals.QUIT:
+                        self.close()
+
+                    renderer.process_event(event)
+                    self.process_event(event)
+
+            steps = 0
+            while self.running and now >= next_time and steps < GameClient.MAX_CATCH_UP_STEPS:
+                self.step()
+                next_time += tick_seconds
+                steps += 1
+
+            next_time = max(next_time, now - tick_seconds)
+
+            if renderer is not None and self.synced:
+                renderer.render(self, 1 - (next_time - now) / tick_seconds)
+
+            await asyncio.sleep(max(next_time - loop.time(), 0))
+
+        return self.ended
+
+async def start_loopback_server(world: WorldConfig, seed: Union[int, str], **kwargs) -> Tuple[GameServer, asyncio.Task, Address]:
+    """ Starts a server on localhost, in the current event loop, for testing. Returns the server, the task running it and its address. """
+    server = GameServer(world, seed, **kwargs)
+    address = await server.listen('127.0.0.1', 0)
+    return server, asyncio.create_task(server.run()), address
@@ -1,5 +1,6 @@
 """ Holds all important constants that define the game's behaviour """
 
+import copy
 import math
 from typing import Union
 
@@ -11,6 +12,9 @@ class WorldConfig:
         return WorldConfigBuilder()
 
     def __init__(self, params):
+        # The parameters the world was built with, so that it can be saved and built again
+        self.params = copy.deepcopy(params)
+
         self.width: int = params["width"]
 
         self.friction: Union[int, float] = params["friction"]
@@ -0,0 +1,165 @@
+""" Handles saving and loading landscapes (courses) to and from a compact binary format
+
+The format is made of (every number is little-endian):
+    - a header, with the magic bytes, the version of the format and the parameters of the world;
+    - the number of flag pairs and the number of trees, as int32;
+    - the flag pairs, as int32 (y, left_x) pairs, sorted by y;
+    - the trees, as int32 (x, y) centers, sorted by the bottom of the trees.
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+from itertools import islice
+from typing import List, Sequence, Union
+
+from game.config import WorldConfig
+from game.landscape import Flag, FlagPairs, Landscape, Tree, Trees
+
+MAGIC = b'SKIC'
+VERSION = 1
+
+# magic, version, width, height, difficulty, gravity, inclination, friction, flags (4), trees_margin_to_flags, ammounts (2)
+HEADER = struct.Struct('<4sHxxididdd4ii2i')
+COUNTS = struct.Struct('<ii')
+
+class Offset(Sequence[int]):
+    """ A view of a sequence of numbers, all of them moved by the same offset """
+    def __init__(self, values: Sequence[int], offset: int):
+        self.values = values
+        self.offset = offset
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [value + self.offset for value in self.values[index]]
+
+        return self.values[index] + self.offset
+
+def is_sorted(values: Sequence[int], strict: bool = False) -> bool:
+    """ Checks, in a single pass, that every value is greater than (or equal to, unless strict) the previous one. """
+    if strict:
+        return all(previous < value for previous, value in zip(values, islice(values, 1, None)))
+
+    return all(previous <= value for previous, value in zip(values, islice(values, 1, None)))
+
+def save_course(landscape: Landscape, path: str):
+    """ Saves the world and the obstacles of a landscape to a file. """
+    params = landscape.world.params
+    header = HEADER.pack(
+        MAGIC, VERSION,
+        params["width"], params["height"], params["difficulty"],
+        params["gravity"], params["inclination"], params["friction"],
+        *params["flags"], params["trees_margin_to_flags"], *params["ammounts"]
+    )
+
+    flag_pairs = array('i', (value for pair in zip(landscape.flag_pair_ys, landscape.flag_pair_left_xs) for value in pair))
+    trees = array('i', (value for center in zip(landscape.tree_xs, landscape.tree_ys) for value in center))
+
+    if sys.byteorder != 'little':
+        flag_pairs.byteswap()
+        trees.byteswap()
+
+    with open(path, 'wb') as file:
+        file.write(header)
+        file.write(COUNTS.pack(len(landscape.flag_pairs), len(landscape.trees)))
+        file.write(flag_pairs.tobytes())
+        file.write(trees.tobytes())
+
+class CourseLandscape(Landscape):
+    """ A landscape loaded from a course file. The file is memory-mapped and
+    the columns of the obstacles are views over it, like the arrays of Landscape. """
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Every view of the file needs to be released before closing it
+        self.views: List[memoryview] = []
+
+        magic, version, *values = HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a course file.")
+
+        if version != VERSION:
+            raise ValueError(f"{path} has version {version} of the course format, but only version {VERSION} is supported.")
+
+        width, height, difficulty, gravity, inclination, friction, *values = values
+        world = WorldConfig({
+            "width": width,
+            "height": height,
+            "difficulty": difficulty,
+            "gravity": gravity,
+            "inclination": inclination,
+            "friction": friction,
+            "flags": values[0:4],
+            "trees_margin_to_flags": values[4],
+            "ammounts": values[5:7]
+        })
+
+        flag_pairs_count, trees_count = COUNTS.unpack_from(self.mmap, HEADER.size)
+        offset = HEADER.size + COUNTS.size
+
+        flag_pairs = self.__int32s(offset, 2 * flag_pairs_count)
+        offset += 8 * flag_pairs_count
+
+        trees = self.__int32s(offset, 2 * trees_count)
+
+        self.width = world.width
+        self.height = world.height
+        self.world = world
+        self.version = 0
+
+        # Instead of Landscape.set_obstacles, which needs every obstacle,
+        # the columns are views over the file.
+        self.flag_pair_ys = self.__view(flag_pairs[0::2])
+        self.flag_pair_left_xs = self.__view(flag_pairs[1::2])
+        self.flag_pairs = FlagPairs(world, self.flag_pair_ys, self.flag_pair_left_xs)
+        self.flag_pairs_reach = max(Flag.get_size(False)[1], Flag.get_size(True)[1])
+
+        tree_height = Tree.get_size()[1]
+        self.tree_xs = self.__view(trees[0::2])
+        self.tree_ys = self.__view(trees[1::2])
+        self.tree_bottoms = Offset(self.tree_ys, tree_height - tree_height // 2)
+        self.trees = Trees(self.tree_xs, self.tree_ys)
+        self.trees_reach = tree_height
+
+        # The collision checks and the renderer find the obstacles with binary searches,
+        # which silently miss obstacles if the file isn't sorted (like Landscape.set_obstacles, no two pairs share a y value)
+        if not is_sorted(self.flag_pair_ys, strict=True):
+            self.close()
+            raise ValueError(f"{path} is corrupted, its flag pairs are not sorted by y.")
+
+        if not is_sorted(self.tree_ys):
+            self.close()
+            raise ValueError(f"{path} is corrupted, its trees are not sorted by y.")
+
+    def __view(self, view):
+        if isinstance(view, memoryview):
+            self.views.append(view)
+
+        return view
+
+    def __int32s(self, offset: int, count: int) -> Union[memoryview, array]:
+        data = self.__view(memoryview(self.mmap)[offset:offset + 4 * count])
+        if sys.byteorder == 'little':
+            return self.__view(data.cast('i'))
+
+        # Big-endian machines can't use the file as it is
+        values = array('i', data.tobytes())
+        values.byteswap()
+        return values
+
+    def close(self):
+        """ Releases the file, the landscape can't be used afterwards. """
+        for view in reversed(self.views):
+            view.release()
+
+        self.mmap.close()
+
+def load_course(path: str) -> CourseLandscape:
+    """ Loads a landscape from a file saved with save_course. """
+    return CourseLandscape(path)
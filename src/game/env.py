@@ -0,0 +1,224 @@
+""" Holds the environments to train steering policies in: races of a single skier, advanced by
+the actions of a policy instead of the events of a window (in the style of Gym), without rendering
+
+    game.player.init()
+    env = SkiingEnv()
+    observation, info = env.reset(seed=1)
+    observation, reward, terminated, truncated, info = env.step(SkiingEnv.RIGHT)
+"""
+
+import math
+import random
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Tuple, Union
+
+import numpy as np
+from pygame import Vector2
+
+import game
+from game.config import WorldConfig
+from game.landscape import LocalLandscape
+from game.modes import default_slalom_config
+from game.player import Player
+
+class AgentPlayer(Player):
+    """ A player turned by the actions of a policy, instead of a keyboard """
+    uses_keyboard = False
+
+class SkiingEnv:
+    """ A race of a single skier. Every step applies an action (one of ACTIONS) and advances
+    the race by ticks_per_step ticks, like a skier that only reacts every few ticks.
+
+    The reward is GATE_REWARD for every gate scored, minus TIME_PENALTY for every second,
+    so the return of a race is its score in the game (its time plus a penalty for every missed gate), negated and shifted. """
+
+    # The actions are indices into this list of directions to turn to, 0 keeps going
+    KEEP = 0
+    LEFT = 1
+    RIGHT = 2
+    ACTIONS = [0, -1, 1]
+
+    # The gates and the trees ahead of the skier that it can see
+    GATES = 2
+    TREES = 4
+    LOOKAHEAD = 300
+
+    # Every observation is:
+    #   - the skier: x, vx, vy, sin and cos of its angle, whether it is down and whether it is invulnerable
+    #   - each gate: dx to its left end and to its right end, dy, and whether it is there (1) or not (0)
+    #   - each tree: dx and dy to the middle of its collision box, and whether it is there
+    # The positions are relative to the skier and, like the velocities, divided by SCALE.
+    PLAYER_SIZE = 7
+    GATE_SIZE = 4
+    TREE_SIZE = 3
+    OBSERVATION_SIZE = PLAYER_SIZE + GATES * GATE_SIZE + TREES * TREE_SIZE
+    SCALE = 100
+
+    GATE_REWARD = 5
+    TIME_PENALTY = 1
+
+    TICKS_PER_STEP = 4
+
+    # The race is cut short (truncated) after this many milliseconds of game time
+    MAX_MILLIS = 5 * 60 * 1000
+
+    def __init__(self, world: WorldConfig = default_slalom_config, ticks_per_step: int = TICKS_PER_STEP, max_millis: int = MAX_MILLIS):
+        assert ticks_per_step > 0
+        assert max_millis > 0
+
+        self.world = world
+        self.ticks_per_step = ticks_per_step
+        self.max_millis = max_millis
+
+        self.landscape: Union[LocalLandscape, None] = None
+        self.player: Union[AgentPlayer, None] = None
+        self.game: Union[game.Game, None] = None
+        self.collisions = 0
+
+        # Used when reset isn't given a seed
+        self.rng = random.Random()
+
+    def reset(self, seed: Union[int, None] = None) -> Tuple[np.ndarray, Dict[str, Any]]:
+        """ Starts a new race, in the landscape of the given seed (or of a random one). """
+        if seed is not None:
+            self.rng.seed(seed)
+
+        self.landscape = LocalLandscape(self.world, self.rng.randrange(2 ** 32))
+        self.player = AgentPlayer(self.landscape, Vector2(self.world.width / 2, 0), Vector2(0, 0))
+        self.game = game.Game(None, self.landscape, self.player)
+        self.collisions = 0
+
+        observation = np.zeros(SkiingEnv.OBSERVATION_SIZE, dtype=np.float32)
+        self.observe(observation)
+        return observation, self.get_info()
+
+    def step(self, action: int) -> Tuple[np.ndarray, float, bool, bool, Dict[str, Any]]:
+        """ Applies the action and advances the race. Returns the observation, the reward,
+        whether the race ended (terminated), whether it was cut short (truncated) and the info. """
+        observation = np.zeros(SkiingEnv.OBSERVATION_SIZE, dtype=np.float32)
+        reward, terminated, truncated = self.advance(action)
+        self.observe(observation)
+        return observation, reward, terminated, truncated, self.get_info()
+
+    def advance(self, action: int) -> Tuple[float, bool, bool]:
+        """ Applies the action and advances the race, without observing it. """
+        assert self.game is not None and self.player is not None, "The environment needs to be reset first."
+
+        direction = SkiingEnv.ACTIONS[action]
+        inputs = {self.player.uuid: direction} if direction != 0 else None
+
+        score = self.player.score
+        millis = max(self.game.game_millis, 0)
+        dt = 1000 / self.game.tick_rate * self.world.time_factor
+
+        running = True
+        for _ in range(self.ticks_per_step):
+            running = self.game.step(dt, inputs)
+            inputs = None
+
+            # A collision is the only thing that sets it back to 0
+            if self.player.time_since_last_collision == 0:
+                self.collisions += 1
+
+            if not running:
+                break
+
+        reward = (self.player.score - score) * SkiingEnv.GATE_REWARD - (self.game.game_millis - millis) / 1000 * SkiingEnv.TIME_PENALTY
+        return reward, not running, running and self.game.game_millis >= self.max_millis
+
+    def observe(self, observation: np.ndarray):
+        """ Writes the observation of the race into the given array, of OBSERVATION_SIZE values. """
+        assert self.landscape is not None and self.player is not None
+
+        player = self.player
+        landscape = self.landscape
+        scale = SkiingEnv.SCALE
+        x, y = player.pos
+        angle = math.radians(Player.get_states()[player.state][0])
+
+        values: List[float] = [
+            x / scale,
+            player.velocity.x / scale,
+            player.velocity.y / scale,
+            math.sin(angle),
+            math.cos(angle),
+            1 if player.time_since_last_collision < Player.DOWN_TIME else 0,
+            1 if player.time_since_last_collision < Player.INVULN_TIME else 0
+        ]
+
+        # The gates that are still ahead, starting at the cursor the game keeps
+        gates = 0
+        for i in range(player.next_pair_index, len(landscape.flag_pairs)):
+            if gates == SkiingEnv.GATES:
+                break
+
+            box = landscape.flag_pairs[i].collision_box
+            if box.bottom > player.collision_box.top:
+                values += [(box.left - x) / scale, (box.right - x) / scale, (box.bottom - y) / scale, 1]
+                gates += 1
+
+        values += [0] * (SkiingEnv.GATES - gates) * SkiingEnv.GATE_SIZE
+
+        # The trees are sorted by the bottom of their collision boxes
+        start = bisect_right(landscape.tree_bottoms, player.collision_box.top)
+        end = bisect_left(landscape.tree_bottoms, y + SkiingEnv.LOOKAHEAD, start)
+        end = min(end, start + SkiingEnv.TREES)
+        for i in range(start, end):
+            box = landscape.tree_collision_box(i)
+            values += [(box.centerx - x) / scale, (box.centery - y) / scale, 1]
+
+        values += [0] * (SkiingEnv.TREES - (end - start)) * SkiingEnv.TREE_SIZE
+
+        observation[:] = values
+
+    def get_info(self) -> Dict[str, Any]:
+        assert self.game is not None and self.player is not None
+        return {"gates": self.player.score, "millis": max(self.game.game_millis, 0), "collisions": self.collisions}
+
+class SkiingVectorEnv:
+    """ Many independent races, stepped together: the observations, the rewards and the flags
+    are arrays with a row for each race. A race that ends is reset right away (with a seed taken from
+    the seed of the last reset), its last observation and info are in the info of the step that ended it. """
+    def __init__(self, n: int, world: WorldConfig = default_slalom_config, **kwargs):
+        assert n > 0
+
+        self.envs = [SkiingEnv(world, **kwargs) for _ in range(n)]
+        self.observations = np.zeros((n, SkiingEnv.OBSERVATION_SIZE), dtype=np.float32)
+        self.rng = random.Random()
+
+    def reset(self, seed: Union[int, None] = None) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        if seed is not None:
+            self.rng.seed(seed)
+
+        infos = []
+        for i, env in enumerate(self.envs):
+            observation, info = env.reset(self.rng.randrange(2 ** 32))
+            self.observations[i] = observation
+            infos.append(info)
+
+        return self.observations.copy(), infos
+
+    def step(self, actions: Union[np.ndarray, List[int]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, List[Dict[str, Any]]]:
+        assert len(actions) == len(self.envs)
+
+        n = len(self.envs)
+        rewards = np.zeros(n, dtype=np.float32)
+        terminated = np.zeros(n, dtype=bool)
+        truncated = np.zeros(n, dtype=bool)
+        infos = []
+
+        for i, env in enumerate(self.envs):
+            rewards[i], terminated[i], truncated[i] = env.advance(int(actions[i]))
+            env.observe(self.observations[i])
+            info = env.get_info()
+
+            if terminated[i] or truncated[i]:
+                final_observation, final_info = self.observations[i].copy(), info
+                observation, info = env.reset(self.rng.randrange(2 ** 32))
+                self.observations[i] = observation
+                info["final_observation"] = final_observation
+                info["final_info"] = final_info
+
+            infos.append(info)
+
+        return self.observations.copy(), rewards, terminated, truncated, infos
@@ -0,0 +1,95 @@
+""" Holds all logic related to the heads-up display (the timer and the remaining gates) """
+
+from typing import Dict, List, Tuple
+
+from pygame import Rect, Surface
+
+import game.assets
+import game.utils
+
+Color = Tuple[int, int, int]
+
+class GlyphAtlas:
+    """ Holds a pre-rendered surface for every character of a font, so that text can be composed without rendering it again """
+    def __init__(self, font: game.assets.Font, color: Color, background: Color, characters: str = "0123456789:.-"):
+        self.font = font
+        self.color = color
+        self.background = background
+        self.height = font.get_height()
+
+        self.glyphs: Dict[str, Surface] = {}
+        for char in characters:
+            self.get(char)
+
+    def get(self, char: str) -> Surface:
+        """ Returns the surface of a character, rendering it the first time it is needed. """
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            glyph = self.font.render(char, True, self.color, self.background)
+            self.glyphs[char] = glyph
+
+        return glyph
+
+class HudText:
+    """ A text of the HUD, composed from the glyphs of an atlas. When the text changes,
+    only the characters that changed are drawn again, if the others stay in place. """
+    def __init__(self, atlas: GlyphAtlas):
+        self.atlas = atlas
+        self.text = ""
+        self.offsets: List[int] = []
+        self.surface = Surface((0, atlas.height))
+
+    def set_text(self, text: str):
+        if text == self.text:
+            return
+
+        glyphs = [self.atlas.get(char) for char in text]
+
+        offsets = []
+        width = 0
+        for glyph in glyphs:
+            offsets.append(width)
+            width += glyph.get_width()
+
+        if offsets == self.offsets and width == self.surface.get_width():
+            for i, char in enumerate(text):
+                if char != self.text[i]:
+                    self.surface.blit(glyphs[i], (offsets[i], 0))
+        else:
+            self.surface = Surface((width, self.atlas.height))
+            self.surface.fill(self.atlas.background)
+            self.surface.blits([(glyph, (offset, 0)) for glyph, offset in zip(glyphs, offsets)], doreturn=False)
+
+        self.text = text
+        self.offsets = offsets
+
+class Hud:
+    """ Draws the timer and the remaining gates of a player in the header of a screen """
+
+    COLOR = (0, 0, 0)
+    def __init__(self, header: Rect, background: Color):
+        self.header = header
+        self.background = background
+
+        self.points = HudText(GlyphAtlas(game.assets.get_font("Pixeboy", 48), Hud.COLOR, background))
+        self.time = HudText(GlyphAtlas(game.assets.get_font("Pixeboy", 32), Hud.COLOR, background))
+
+    def render(self, screen: Surface, obj, player) -> Rect:
+        """ Draws the HUD of the given player in the game, and returns the area of the screen it covers. """
+        screen.fill(self.background, self.header)
+
+        self.time.set_text(game.utils.format_millis(obj.game_millis))
+        self.points.set_text(str(obj.landscape.world.flags_ammount - player.score))
+
+        points_rect = self.points.surface.get_rect()
+        time_rect = self.time.surface.get_rect()
+
+        points_rect.midbottom = self.header.center
+        time_rect.midtop = self.header.center
+
+        time_rect.move_ip(0, 10)
+
+        screen.blit(self.time.surface, time_rect)
+        screen.blit(self.points.surface, points_rect)
+
+        return self.header
@@ -1,7 +1,14 @@
 """ Handles landscape generation and collision checks """
 
+import abc
+import math
 import random
-from typing import List, overload
+import warnings
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union, overload
+
+import numpy as np
 from pygame import Surface, Rect
 
 import game.assets
@@ -9,9 +16,33 @@ from game.camera import Camera
 from game.config import WorldConfig
 from game.types import Vector
 
-class Collidable:
-    def __init__(self, collision_box: Rect):
-        self.collision_box = collision_box
+def sweeps(collision_box: Rect, previous_box: Rect, box: Rect) -> bool:
+    """ Checks if a box moving in a straight line from previous_box to box touches collision_box along the way. """
+    if previous_box.topleft == box.topleft:
+        return bool(collision_box.colliderect(box))
+
+    # The moving box touches the collision box if and only if
+    # its top left corner is inside the collision box grown by the size of the moving box,
+    # so we only need to clip the path of that corner against it.
+    reach = Rect(
+        collision_box.left - box.width + 1,
+        collision_box.top - box.height + 1,
+        collision_box.width + box.width - 1,
+        collision_box.height + box.height - 1
+    )
+
+    return len(reach.clipline(previous_box.topleft, box.topleft)) != 0
+
+class Collidable(abc.ABC):
+    """ Something the players can collide with. Its collision box is made when it is asked for,
+    by the subclasses, instead of being stored. """
+
+    __slots__ = ()
+
+    @property
+    @abc.abstractmethod
+    def collision_box(self) -> Rect:
+        """ The box the players collide with. """
 
     @overload
     def collides_at(self, pos) -> bool: ...
@@ -29,69 +60,214 @@ class Collidable:
             return bool(self.collision_box.colliderect(first))
 
         return len(self.collision_box.clipline(first, second)) != 0
+
+    def sweeps(self, previous_box: Rect, box: Rect) -> bool:
+        """ Checks if a box moving in a straight line from previous_box to box touches the collision box along the way. """
+        return sweeps(self.collision_box, previous_box, box)
+
 class Obstacle(Collidable):
-    def __init__(self, image: Surface, rect: Rect, collision_box: Rect):
-        assert image.get_width() == rect.width
-        assert image.get_height() == rect.height
+    """ A collidable that is drawn, with an image at rect """
+
+    __slots__ = ()
 
-        super().__init__(collision_box)
-        self.image = image
-        self.rect = rect
+    @property
+    @abc.abstractmethod
+    def image(self) -> Surface:
+        """ The image drawn at rect. """
+
+    @property
+    @abc.abstractmethod
+    def rect(self) -> Rect:
+        """ Where the image is drawn. """
 
     def render(self, camera: Camera):
-        return camera.blit(self.image, self.rect)
+        camera.enqueue(self.image, self.rect)
 
 class Flag(Obstacle):
+    """ A flag, which only keeps the bottom right corner of its rect """
 
     COLLISION_BOX_WIDTH = 10
+
+    # The sizes of the images of the flags (the last one and the others), looked up once (see get_size)
+    sizes: Dict[bool, Tuple[int, int]] = {}
+
+    __slots__ = ('right', 'bottom', 'is_last')
     def __init__(self, bottomright: Vector, is_last: bool):
-        image = game.assets.get_image('flag') if not is_last else game.assets.get_image('flag-final')
+        self.right = int(bottomright[0])
+        self.bottom = int(bottomright[1])
+        self.is_last = is_last
+
+    @staticmethod
+    def get_size(is_last: bool) -> Tuple[int, int]:
+        size = Flag.sizes.get(is_last)
+        if size is None:
+            size = Flag.sizes[is_last] = game.assets.get_image('flag' if not is_last else 'flag-final').rect.size
+
+        return size
 
-        # set the bottom right corner of the Rect at bottomright
-        rect = image.rect.move(bottomright[0] - image.rect.width, bottomright[1] - image.rect.height)
+    @staticmethod
+    def get_collision_box(right: int, bottom: int, is_last: bool) -> Rect:
+        """ Returns the collision box of the flag whose rect has the given bottom right corner, without making the flag. """
+        height = Flag.get_size(is_last)[1]
+        return Rect(right - Flag.COLLISION_BOX_WIDTH, bottom - height, Flag.COLLISION_BOX_WIDTH, height)
 
-        collision_box = Rect(0, 0, Flag.COLLISION_BOX_WIDTH, rect.height)
-        collision_box.bottomright = rect.bottomright
+    @property
+    def image(self) -> Surface:
+        return game.assets.get_image('flag' if not self.is_last else 'flag-final').surface
 
-        super().__init__(image.surface, rect, collision_box)
+    @property
+    def rect(self) -> Rect:
+        width, height = Flag.get_size(self.is_last)
+        return Rect(self.right - width, self.bottom - height, width, height)
+
+    @property
+    def collision_box(self) -> Rect:
+        return Flag.get_collision_box(self.right, self.bottom, self.is_last)
 
 class FlagPair(Collidable):
+    """ A pair of flags, the players score by going through the gap between them (its collision box).
+    Only its y value and the x value of its left flag are kept, everything else is made from them. """
 
     COLLISION_BOX_HEIGHT = 5
+
+    __slots__ = ('world', 'y', 'left_x')
     def __init__(self, world: WorldConfig, y: int, left_x: int):
+        self.world = world
         self.y = y
         self.left_x = left_x
-        self.right_x = left_x + world.flags_distance_in_between
-
-        is_final = y == world.flags_start + (world.flags_ammount - 1) * world.flags_spacing_vertical
-        self.left = Flag((self.left_x, y), is_final)
-        self.right = Flag((self.right_x, y), is_final)
 
-        collision_box = Rect(0, 0, world.flags_distance_in_between, FlagPair.COLLISION_BOX_HEIGHT)
-        collision_box.bottomleft = self.left.rect.bottomright
-
-        super().__init__(collision_box)
+    @property
+    def right_x(self) -> int:
+        return self.left_x + self.world.flags_distance_in_between
+
+    @property
+    def is_final(self) -> bool:
+        return FlagPair.is_final_at(self.world, self.y)
+
+    @staticmethod
+    def is_final_at(world: WorldConfig, y: int) -> bool:
+        return y == world.flags_start + (world.flags_ammount - 1) * world.flags_spacing_vertical
+
+    @property
+    def left(self) -> Flag:
+        return Flag((self.left_x, self.y), self.is_final)
+
+    @property
+    def right(self) -> Flag:
+        return Flag((self.right_x, self.y), self.is_final)
+
+    @property
+    def collision_box(self) -> Rect:
+        return Rect(self.left_x, self.y - FlagPair.COLLISION_BOX_HEIGHT, self.world.flags_distance_in_between, FlagPair.COLLISION_BOX_HEIGHT)
+
+    @staticmethod
+    def get_collision_boxes(world: WorldConfig, y: int, left_x: int) -> Tuple[Rect, Rect, Rect]:
+        """ Returns the collision boxes of the gap, the left flag and the right flag of the pair at y and left_x, without making the pair. """
+        distance = world.flags_distance_in_between
+        width = Flag.COLLISION_BOX_WIDTH
+        height = Flag.get_size(FlagPair.is_final_at(world, y))[1]
+        return (
+            Rect(left_x, y - FlagPair.COLLISION_BOX_HEIGHT, distance, FlagPair.COLLISION_BOX_HEIGHT),
+            Rect(left_x - width, y - height, width, height),
+            Rect(left_x + distance - width, y - height, width, height)
+        )
 
     def render(self, camera: Camera):
         self.left.render(camera)
         self.right.render(camera)
 
+    # A new view is made every time a pair is asked for, so the same pair is told apart by its position
+    def __eq__(self, o: object) -> bool:
+        if not isinstance(o, FlagPair):
+            return False
+
+        return o.y == self.y and o.left_x == self.left_x
+
+    def __hash__(self) -> int:
+        return hash((self.y, self.left_x))
+
 class Tree(Obstacle):
+    """ A tree, which only keeps its center """
 
     COLLISION_BOX_HEIGHT = 10
+
+    # The size of the image of the trees, looked up once (see get_size)
+    size: Union[Tuple[int, int], None] = None
+
+    __slots__ = ('x', 'y')
     def __init__(self, center: Vector):
-        image = game.assets.get_image('tree')
+        self.x = int(center[0])
+        self.y = int(center[1])
+
+    @staticmethod
+    def get_size() -> Tuple[int, int]:
+        if Tree.size is None:
+            Tree.size = game.assets.get_image('tree').rect.size
+
+        return Tree.size
+
+    @property
+    def image(self) -> Surface:
+        return game.assets.get_image('tree').surface
+
+    @property
+    def rect(self) -> Rect:
+        width, height = Tree.get_size()
+        return Rect(self.x - width // 2, self.y - height // 2, width, height)
+
+    @property
+    def collision_box(self) -> Rect:
+        width, height = Tree.get_size()
+        return Rect(self.x - width // 2, self.y - height // 2 + height - Tree.COLLISION_BOX_HEIGHT, width, Tree.COLLISION_BOX_HEIGHT)
+
+class FlagPairs(Sequence[FlagPair]):
+    """ The flag pairs of a landscape, as columns of their y values and the x values of their left flags.
+    The pairs are views, made every time they are asked for. """
+    def __init__(self, world: WorldConfig, ys: Sequence[int], left_xs: Sequence[int]):
+        self.world = world
+        self.ys = ys
+        self.left_xs = left_xs
+
+    def __len__(self):
+        return len(self.ys)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        return FlagPair(self.world, self.ys[index], self.left_xs[index])
 
-        rect = image.rect.copy()
-        rect.center = (int(center[0]), int(center[1]))
+class Trees(Sequence[Tree]):
+    """ The trees of a landscape, as columns of the x and y values of their centers.
+    The trees are views, made every time they are asked for. """
+    def __init__(self, xs: Sequence[int], ys: Sequence[int]):
+        self.xs = xs
+        self.ys = ys
 
-        collision_box = Rect(0, 0, rect.width, Tree.COLLISION_BOX_HEIGHT)
-        collision_box.midbottom = rect.midbottom
+    def __len__(self):
+        return len(self.ys)
 
-        super().__init__(image.surface, rect, collision_box)
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        return Tree((self.xs[index], self.ys[index]))
 
 class Landscape:
-    def __init__(self, world: WorldConfig, flag_pairs: List[FlagPair], trees: List[Tree]):
+    def __init__(self, world: WorldConfig, flag_pairs: List[FlagPair], trees: Sequence[Tree]):
+        self.width = world.width
+        self.height = world.height
+
+        self.world = world
+
+        # Changes every time the obstacles are replaced
+        self.version = 0
+        self.set_obstacles(flag_pairs, trees)
+
+    def set_obstacles(self, flag_pairs: List[FlagPair], trees: Sequence[Tree]):
+        """ Replaces every obstacle of the landscape and indexes them for the collision checks and the renderer.
+        The obstacles are packed into arrays (a column for each value), flag_pairs and trees are views over them.
+        If trees is already made of columns (Trees), they are read straight from them. """
         # We need to verify if the given landscape is valid.
         # Therefore, we only need to verify the flags list.
         # The flag_pairs array needs to meet one requirement:
@@ -103,19 +279,295 @@ class Landscape:
 
             assert current_y < next_y
 
-        self.width = world.width
-        self.height = world.height
-
+        self.version += 1
+
+        self.flag_pair_ys = array('i', [pair.y for pair in flag_pairs])
+        self.flag_pair_left_xs = array('i', [pair.left_x for pair in flag_pairs])
+        self.flag_pairs = FlagPairs(self.world, self.flag_pair_ys, self.flag_pair_left_xs)
+
+        # Every collision box of a pair ends at its y value,
+        # so we only need to know how far up they can reach.
+        self.flag_pairs_reach = max((pair.y - min(pair.left.collision_box.top, pair.right.collision_box.top, pair.collision_box.top) for pair in flag_pairs), default=0)
+
+        # Trees are kept sorted by the bottom of their rects,
+        # which is also the bottom of their collision boxes.
+        # This allows us to find the trees near a given rect
+        # with a binary search, instead of checking every tree.
+        # Every tree has the same size, so they are sorted by their centers.
+        tree_height = Tree.get_size()[1]
+        if isinstance(trees, Trees):
+            xs, ys = np.array(trees.xs, dtype=np.int32), np.array(trees.ys, dtype=np.int32)
+        else:
+            xs, ys = np.array([tree.x for tree in trees], dtype=np.int32), np.array([tree.y for tree in trees], dtype=np.int32)
+
+        # A stable sort, so that the trees at the same height keep their order
+        order = np.argsort(ys, kind='stable')
+        self.tree_xs = array('i', xs[order].tobytes())
+        self.tree_ys = array('i', ys[order].tobytes())
+        self.tree_bottoms = array('i', (ys[order] - tree_height // 2 + tree_height).tobytes())
+        self.trees = Trees(self.tree_xs, self.tree_ys)
+        self.trees_reach = tree_height if len(order) else 0
+
+    def update(self, players: Iterable[Vector]):
+        """ Called before every step of the game with the positions of the players, a static landscape does nothing. """
+
+    def tree_collision_box(self, index: int) -> Rect:
+        """ Returns the collision box of the tree at the given index into trees, without making the tree. """
+        width = Tree.get_size()[0]
+        return Rect(self.tree_xs[index] - width // 2, self.tree_bottoms[index] - Tree.COLLISION_BOX_HEIGHT, width, Tree.COLLISION_BOX_HEIGHT)
+
+    def trees_near(self, rect: Rect) -> Iterator[Rect]:
+        """ Yields the collision box of every tree that may intersect the given rect. """
+        # A tree's collision box spans [bottom - COLLISION_BOX_HEIGHT, bottom),
+        # so it can only intersect the rect if its bottom is in
+        # the interval ]rect.top, rect.bottom + COLLISION_BOX_HEIGHT[
+        bottoms = self.tree_bottoms
+        start = bisect_right(bottoms, rect.top)
+        end = bisect_left(bottoms, rect.bottom + Tree.COLLISION_BOX_HEIGHT, start)
+
+        # The boxes are made straight from the columns, only for the trees that overlap the rect horizontally too
+        xs = self.tree_xs
+        width = Tree.get_size()[0]
+        half_width = width // 2
+        height = Tree.COLLISION_BOX_HEIGHT
+        left, right = rect.left, rect.right
+        for i in range(start, end):
+            x = xs[i] - half_width
+            if x < right and x + width > left:
+                yield Rect(x, bottoms[i] - height, width, height)
+
+    def trees_between(self, top: float, bottom: float) -> Tuple[int, int]:
+        """ Returns the range of indices into trees of every tree that may be drawn between the given y values. """
+        start = bisect_right(self.tree_bottoms, top)
+        end = bisect_left(self.tree_bottoms, bottom + self.trees_reach, start)
+        return start, end
+
+    def flag_pairs_between(self, top: float, bottom: float) -> Tuple[int, int]:
+        """ Returns the range of indices into flag_pairs of every flag pair that may be drawn between the given y values. """
+        start = bisect_right(self.flag_pair_ys, top)
+        end = bisect_left(self.flag_pair_ys, bottom + self.flag_pairs_reach, start)
+        return start, end
+
+    def advance_flag_cursor(self, cursor: int, rect: Rect) -> int:
+        """ Moves a cursor into flag_pairs to the first pair that is not completely above the given rect. """
+        # The cursor only moves a pair or two per tick,
+        # so both loops run in constant time most of the time.
+        ys = self.flag_pair_ys
+        cursor = min(cursor, len(ys))
+        while cursor > 0 and ys[cursor - 1] > rect.top:
+            cursor -= 1
+
+        while cursor < len(ys) and ys[cursor] <= rect.top:
+            cursor += 1
+
+        return cursor
+
+    def flag_pairs_near(self, rect: Rect, cursor: int) -> Iterator[Tuple[int, Rect, Rect, Rect]]:
+        """ Yields every flag pair, starting at the given cursor, whose collision boxes may intersect the given rect:
+        its index into flag_pairs and the collision boxes of its gap, its left flag and its right flag (see FlagPair.get_collision_boxes). """
+        ys = self.flag_pair_ys
+        bottom = rect.bottom + self.flag_pairs_reach
+        for i in range(cursor, len(ys)):
+            y = ys[i]
+            if y >= bottom:
+                break
+
+            # The boxes of a pair span from the left of its left flag to the right of its right flag
+            left_x = self.flag_pair_left_xs[i]
+            if left_x - Flag.COLLISION_BOX_WIDTH < rect.right and left_x + self.world.flags_distance_in_between > rect.left:
+                yield (i,) + FlagPair.get_collision_boxes(self.world, y, left_x)
+
+class TreeSampler:
+    """ Places trees at random, without overlapping each other nor the flags (rejection sampling over an occupancy grid) """
+
+    MAX_ATTEMPTS = 1000
+    # The attempts are drawn and checked against the trees placed so far in batches (of at most BATCH_SIZE attempts)
+    BATCH_SIZE = 16384
+    # Where an empty cell of the grid is, far from every tree
+    NOWHERE = -(1 << 30)
+    def __init__(self, world: WorldConfig, flag_pairs: List[FlagPair], rng = random):
         self.world = world
-
         self.flag_pairs = flag_pairs
-        self.trees = trees
+        self.flag_pair_ys = [pair.y for pair in flag_pairs]
+        self.flags_reach = max((max(pair.left.rect.height, pair.right.rect.height) for pair in flag_pairs), default=0)
+        self.rng = rng
+
+        # The trees between a pair and the next one stay out of the corridor that goes through both of them,
+        # which only depends on the first pair, so the corridors are found once, instead of on every attempt.
+        margin = world.trees_margin_to_flags
+        corridors: List[Tuple[int, int]] = []
+        for i, pair in enumerate(flag_pairs):
+            next_pair = flag_pairs[min(i + 1, len(flag_pairs) - 1)]
+            corridors.append((min(pair.left_x, next_pair.left_x) - margin, max(pair.right_x, next_pair.right_x) + margin))
+
+        self.corridor_min_xs = np.array([corridor[0] for corridor in corridors], dtype=np.int64)
+        self.corridor_max_xs = np.array([corridor[1] for corridor in corridors], dtype=np.int64)
+
+        # Two trees overlap if and only if their centers are closer than
+        # the size of a tree on both axis. So, if the grid's cells have the size of a tree,
+        # every cell holds at most one tree and a tree can only overlap the trees in the cells around it.
+        self.tree_rect = game.assets.get_image('tree').rect.copy()
+
+        # The centers of every tree placed so far
+        self.xs = array('i')
+        self.ys = array('i')
+
+        # The cells are numbered row by row, with a spare column so that
+        # the neighbours of the first and last columns don't wrap around
+        self.columns = world.width // self.tree_rect.width + 2
+        self.neighbours = tuple(row * self.columns + column for row in (-1, 0, 1) for column in (-1, 0, 1))
+
+    def sample(self, top: int = 0, bottom: Union[int, None] = None) -> Union[Tree, None]:
+        """ Returns a new tree, whose center is between top and bottom (the world's height by default),
+        or None if no place was found in MAX_ATTEMPTS attempts (the landscape is too crowded). """
+        trees = self.sample_trees(1, top, bottom)
+        return trees[0] if trees else None
+
+    def overlaps(self, x: int, y: int, cells: Dict[int, Tuple[int, int]], cell: int) -> bool:
+        """ Checks if a tree centered on (x, y), in the given cell, overlaps the trees in cells or the flags. """
+        width, height = self.tree_rect.size
+        for neighbour in self.neighbours:
+            other = cells.get(cell + neighbour)
+            if other is not None and abs(other[0] - x) < width and abs(other[1] - y) < height:
+                return True
+
+        # should always be False, anyways
+        rect = self.tree_rect
+        rect.center = (x, y)
+        start = bisect_right(self.flag_pair_ys, rect.top)
+        end = bisect_left(self.flag_pair_ys, rect.bottom + self.flags_reach, start)
+        return start < end and any(rect.colliderect(pair.left.rect) or rect.colliderect(pair.right.rect) for pair in self.flag_pairs[start:end])
+
+    def sample_trees(self, ammount: int, top: int = 0, bottom: Union[int, None] = None) -> Trees:
+        """ Places up to ammount new trees between top and bottom (see sample), straight into the columns of their centers.
+        The placing stops at the first tree that doesn't fit, so fewer trees are returned if the landscape is too crowded.
+
+        Every attempt takes two numbers from the random generator, whether the tree fits or not, so a batch of attempts
+        is drawn at once and the ones that overlap the trees placed before the batch are thrown away together.
+        Only the ones with another attempt around them are checked one by one, and the generator is left
+        as if the attempts had been drawn one by one. """
+        world = self.world
+        bottom = int(world.height) if bottom is None else bottom
+
+        xs = array('i')
+        ys = array('i')
+        if ammount <= 0:
+            return Trees(xs, ys)
+
+        width, height = self.tree_rect.size
+        columns = self.columns
+        rng = self.rng
+        random = rng.random
+        span = bottom - top + 1
+        flag_pair_ys = self.flag_pair_ys
+
+        # The grid covers the rows between top and bottom (and their neighbours),
+        # its empty cells hold a tree that is nowhere, so that they never overlap anything
+        first_row = top // height - 2
+        rows = bottom // height - first_row + 3
+        grid_xs = np.full(rows * columns, TreeSampler.NOWHERE, dtype=np.int64)
+        grid_ys = np.full(rows * columns, TreeSampler.NOWHERE, dtype=np.int64)
+        if self.xs:
+            placed_xs = np.array(self.xs, dtype=np.int64)
+            placed_ys = np.array(self.ys, dtype=np.int64)
+            inside = (placed_ys // height - first_row >= 0) & (placed_ys // height - first_row < rows)
+            placed_cells = (placed_ys[inside] // height - first_row) * columns + placed_xs[inside] // width
+            grid_xs[placed_cells] = placed_xs[inside]
+            grid_ys[placed_cells] = placed_ys[inside]
+
+        # The attempts of the tree being placed, before the current batch
+        failures = 0
+        while len(xs) < ammount:
+            size = min((ammount - len(xs)) * 4 + 16, TreeSampler.BATCH_SIZE)
+            state = rng.getstate()
+            draws = np.array([random() for _ in range(2 * size)])
+
+            batch_ys = top + (draws[0::2] * span).astype(np.int64)
+            if flag_pair_ys:
+                # find the pair of flags that have every tree in between
+                pairs = np.clip(np.searchsorted(flag_pair_ys, batch_ys, side='right') - 1, 0, len(flag_pair_ys) - 1)
+                min_xs = self.corridor_min_xs[pairs]
+                distances_in_between = self.corridor_max_xs[pairs] - min_xs
+                batch_xs = (draws[1::2] * (world.width - distances_in_between + 1)).astype(np.int64)
+                batch_xs += np.where(batch_xs > min_xs, distances_in_between, 0)
+            else:
+                batch_xs = (draws[1::2] * (world.width + 1)).astype(np.int64)
+
+            batch_cells = (batch_ys // height - first_row) * columns + batch_xs // width
+            free = np.ones(size, dtype=bool)
+            for neighbour in self.neighbours:
+                free &= (np.abs(grid_xs[batch_cells + neighbour] - batch_xs) >= width) | (np.abs(grid_ys[batch_cells + neighbour] - batch_ys) >= height)
+
+            # The free attempts may still overlap each other, if there is another free attempt around them,
+            # or the flags, if they are close enough. Only those are checked one by one, in order, the rest fit.
+            indices = np.flatnonzero(free)
+            counts = np.bincount(batch_cells[indices], minlength=rows * columns)
+            crowded = np.zeros(len(indices), dtype=np.int64)
+            for neighbour in self.neighbours:
+                crowded += counts[batch_cells[indices] + neighbour]
+
+            tops = batch_ys[indices] - height // 2
+            near_flags = np.searchsorted(flag_pair_ys, tops, side='right') < np.searchsorted(flag_pair_ys, tops + height + self.flags_reach, side='left')
+
+            fits = np.ones(len(indices), dtype=bool)
+            placed: Dict[int, Tuple[int, int]] = {}
+            misfits = 0
+            for j in np.flatnonzero((crowded > 1) | near_flags).tolist():
+                if j - misfits >= ammount - len(xs):
+                    break # the trees before this attempt are enough
+
+                x, y, cell = int(batch_xs[indices[j]]), int(batch_ys[indices[j]]), int(batch_cells[indices[j]])
+                if self.overlaps(x, y, placed, cell):
+                    fits[j] = False
+                    misfits += 1
+                else:
+                    placed[cell] = (x, y)
+
+            # Every tree is placed in at most MAX_ATTEMPTS attempts after the previous one
+            accepted = indices[fits]
+            gaps = np.diff(accepted, prepend=-1) - 1
+            if len(gaps):
+                gaps[0] += failures
+
+            too_far = np.flatnonzero(gaps >= TreeSampler.MAX_ATTEMPTS)
+            count = min(len(accepted), ammount - len(xs), too_far[0] if len(too_far) else len(accepted))
+            accepted = accepted[:count]
+
+            xs.extend(batch_xs[accepted].tolist())
+            ys.extend(batch_ys[accepted].tolist())
+            grid_xs[batch_cells[accepted]] = batch_xs[accepted]
+            grid_ys[batch_cells[accepted]] = batch_ys[accepted]
+
+            # the attempts that were needed
+            if len(too_far) and count == too_far[0]:
+                used = (accepted[-1] + 1 if count else -failures) + TreeSampler.MAX_ATTEMPTS
+            elif len(xs) == ammount:
+                used = accepted[-1] + 1
+            else:
+                failures = (0 if count else failures) + size - (accepted[-1] + 1 if count else 0)
+                used = size - max(failures - TreeSampler.MAX_ATTEMPTS, 0)
+
+            if used < size or failures >= TreeSampler.MAX_ATTEMPTS:
+                # Gives back the numbers of the attempts that weren't needed
+                rng.setstate(state)
+                for _ in range(2 * used):
+                    random()
+
+                break
+
+        self.xs.extend(xs)
+        self.ys.extend(ys)
+        return Trees(xs, ys)
 
 class LocalLandscape(Landscape):
-    def __init__(self, world: WorldConfig):
+    def __init__(self, world: WorldConfig, seed: Union[int, str, None] = None):
+        """ If seed is None, the landscape is generated with the global random generator. """
+        self.seed = seed
+        rng = random.Random(seed) if seed is not None else random
+
         def new_flag_pair(y) -> FlagPair:
             assert y <= world.height
-            left_x = random.randint(world.flags_left_min, world.flags_left_max)
+            left_x = rng.randint(world.flags_left_min, world.flags_left_max)
             return FlagPair(world, y, left_x)
 
         flag_pairs: List[FlagPair] = []
@@ -125,49 +577,107 @@ class LocalLandscape(Landscape):
 
             flag_pairs.append(pair)
 
-        trees: List[Tree] = []
-        def new_tree() -> Tree:
-            tree = None
-            while True:
-                y = random.randint(0, world.height)
+        sampler = TreeSampler(world, flag_pairs, rng)
+        trees = sampler.sample_trees(world.trees_ammount)
 
-                min_x = max_x = world.width
+        # The trees that didn't fit
+        self.missing_trees = world.trees_ammount - len(trees)
+        if self.missing_trees > 0:
+            warnings.warn(f"Only {len(trees)} of the {world.trees_ammount} trees fit in the landscape, it is too crowded.")
 
-                if world.is_slalom:
-                    # find the pair of flags that have the tree in between
-                    previous_pair_index = (y - world.flags_start) // world.flags_spacing_vertical
+        super().__init__(world, flag_pairs, trees)
 
-                    previous_pair_index = max(previous_pair_index, 0)
-                    previous_pair_index = min(previous_pair_index, world.flags_ammount - 1)
-                    next_pair_index = min(previous_pair_index + 1, world.flags_ammount - 1)
+class ChunkedLandscape(Landscape):
+    """ A landscape that is generated in slices (chunks) of chunk_height, as the players get close to them,
+    and forgets the chunks every player has already passed. Every chunk only depends on the seed and its index. """
 
-                    previous_pair = flag_pairs[previous_pair_index]
-                    next_pair = flag_pairs[next_pair_index]
+    CHUNK_HEIGHT = 2000
+    KEEP_BEHIND = 600
+    def __init__(self, world: WorldConfig, seed: Union[int, str], chunk_height: int = CHUNK_HEIGHT, endless: bool = False):
+        assert chunk_height > 0
+        assert world.is_downhill or not endless, "Only downhill landscapes can be endless."
 
-                    min_x = min(previous_pair.left_x, next_pair.left_x) - world.trees_margin_to_flags
-                    max_x = max(previous_pair.right_x, next_pair.right_x) + world.trees_margin_to_flags
+        self.seed = seed
+        self.chunk_height = chunk_height
+        self.endless = endless
 
-                distance_in_between = max_x - min_x
-                x = random.randint(0, world.width - distance_in_between)
+        # The trees are spread over the chunks with the same density as in the world
+        self.trees_density = world.trees_ammount / world.height if world.height > 0 else 0
 
-                if x > min_x: # doesn't happen in downhill mode (min_x = max_x = world.width)
-                    x += distance_in_between
+        self.chunks: Dict[int, Tuple[List[FlagPair], Trees]] = {}
 
-                tree = Tree((x, y))
+        # The trees that didn't fit in the chunks generated so far
+        self.missing_trees = 0
 
-                collides_with_trees = (tree.rect.colliderect(a_tree.rect) for a_tree in trees)
-                if world.trees_ammount > 75:
-                    collides_with_trees = None
+        super().__init__(world, [], [])
+        if endless:
+            self.height = math.inf
 
-                # should always be False, anyways
-                collides_with_flags = (tree.rect.colliderect(a_flag_pair.left.rect) or tree.rect.colliderect(a_flag_pair.right.rect) for a_flag_pair in flag_pairs)
+        self.update([(0, 0)])
 
-                if not (collides_with_trees and any(collides_with_trees)) and not any(collides_with_flags):
-                    break # we have a good tree (it doesn't collide with anything else), we can stop trying
+    def chunks_count(self) -> Union[int, float]:
+        return math.inf if self.endless else math.ceil(self.height / self.chunk_height)
 
-            return tree
+    def new_flag_pairs(self, index: int) -> List[FlagPair]:
+        """ Returns the flag pairs of the chunk with the given index. """
+        world = self.world
+        if world.is_downhill or index < 0 or index >= self.chunks_count():
+            return []
 
-        for i in range(world.trees_ammount):
-            trees.append(new_tree())
+        rng = random.Random(f"{self.seed}:{index}:flags")
 
-        super().__init__(world, flag_pairs, trees)
+        top = index * self.chunk_height
+        first = max(math.ceil((top - world.flags_start) / world.flags_spacing_vertical), 0)
+        last = min((top + self.chunk_height - 1 - world.flags_start) // world.flags_spacing_vertical, world.flags_ammount - 1)
+
+        return [FlagPair(world, world.flags_start + i * world.flags_spacing_vertical, rng.randint(world.flags_left_min, world.flags_left_max)) for i in range(first, last + 1)]
+
+    def new_chunk(self, index: int) -> Tuple[List[FlagPair], Trees]:
+        """ Generates the chunk with the given index. """
+        flag_pairs = self.new_flag_pairs(index)
+
+        # The trees only avoid the corridors of the flags around them,
+        # and are kept inside the chunk, so that they never overlap the trees of the other chunks.
+        around = self.new_flag_pairs(index - 1) + flag_pairs + self.new_flag_pairs(index + 1)
+        sampler = TreeSampler(self.world, around, random.Random(f"{self.seed}:{index}:trees"))
+
+        chunk_top = index * self.chunk_height
+        chunk_bottom = min(chunk_top + self.chunk_height, self.height)
+
+        tree_height = sampler.tree_rect.height
+        top = chunk_top + tree_height // 2
+        bottom = int(chunk_bottom) - tree_height // 2 - 1
+
+        trees_ammount = round(self.trees_density * (chunk_bottom - chunk_top)) if top <= bottom else 0
+        trees = sampler.sample_trees(trees_ammount, top, bottom)
+
+        # A crowded chunk doesn't stop the race, it only has fewer trees
+        missing = trees_ammount - len(trees)
+        if missing > 0:
+            self.missing_trees += missing
+            warnings.warn(f"Only {len(trees)} of the {trees_ammount} trees fit in chunk {index}, it is too crowded.")
+
+        return flag_pairs, trees
+
+    def update(self, players: Iterable[Vector]):
+        """ Generates the chunks ahead of the leading player and forgets the ones behind the last one. """
+        ys = [pos[1] for pos in players]
+        if not ys:
+            return
+
+        first = max(int((min(ys) - ChunkedLandscape.KEEP_BEHIND) // self.chunk_height), 0)
+        last = min(int((max(ys) + self.chunk_height) // self.chunk_height), self.chunks_count() - 1)
+
+        wanted = range(first, int(last) + 1)
+        if len(self.chunks) == len(wanted) and all(index in self.chunks for index in wanted):
+            return
+
+        self.chunks = {index: self.chunks[index] if index in self.chunks else self.new_chunk(index) for index in wanted}
+
+        flag_pairs = [pair for index in wanted for pair in self.chunks[index][0]]
+        xs, ys = array('i'), array('i')
+        for index in wanted:
+            xs += self.chunks[index][1].xs
+            ys += self.chunks[index][1].ys
+
+        self.set_obstacles(flag_pairs, Trees(xs, ys))
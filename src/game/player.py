@@ -5,16 +5,30 @@ from typing import List, Tuple, Union
 
 import pygame.sprite
 import pygame.draw
-import pygame.transform
 import pygame.locals
-from pygame import Vector2, Rect
+import pygame.mixer
+from pygame import Rect, Surface, Vector2
 from pygame.event import Event
 
 import game.assets
 from game.camera import Camera
 from game.landscape import Tree, Flag, FlagPair, Landscape
 
-class Keyboard:
+class Controller:
+    """ Decides where a player turns to: with the events of the window (process_event),
+    or on its own, before every step of the game (decide). Both return the direction,
+    -1 for left, 1 for right and 0 to keep going. """
+
+    def process_event(self, event: Event) -> int:
+        return 0
+
+    def decide(self, player: 'Player') -> int:
+        return 0
+
+    def release(self):
+        """ Called when its player leaves the game. """
+
+class Keyboard(Controller):
     def __init__(self, k_left: int, k_right: int):
         self.k_left = k_left
         self.k_right = k_right
@@ -39,6 +53,17 @@ class Keyboard:
     def is_turning_right(self, event: Event):
         return event.type == pygame.locals.KEYDOWN and event.key == self.k_right
 
+    def process_event(self, event: Event) -> int:
+        if self.is_turning_left(event):
+            return -1
+        elif self.is_turning_right(event):
+            return 1
+
+        return 0
+
+    def release(self):
+        self.unlock()
+
 KEYBOARDS = [
     Keyboard(pygame.locals.K_LEFT, pygame.locals.K_RIGHT),
     Keyboard(pygame.locals.K_a, pygame.locals.K_d),
@@ -59,34 +84,65 @@ class Player(pygame.sprite.Sprite):
     INVULN_TIME = 4
     DOWN_TIME = 2
 
+    # Players that are simulated by a PlayerPool (see game.pool) have it here
+    pool = None
+
+    turn_sound: Union[game.assets.Sound, None] = None
+
+    # Players that are not driven by a local keyboard (see game.server) don't take one,
+    # unless they are given one
+    uses_keyboard = True
+
     @staticmethod
     def init(states, down):
         Player.__states: List[Tuple[int, game.assets.Image]] = states
         Player.__down: game.assets.Image = down
 
-        game.assets.get_sound('turn') # Load turn sound
+        # Looked up once, instead of on every turn
+        Player.turn_sound = game.assets.get_sound('turn') if pygame.mixer.get_init() else None
+
+    @staticmethod
+    def get_states() -> List[Tuple[int, game.assets.Image]]:
+        """ Returns the (angle, image) pairs of every state a player can be in. """
+        return Player.__states
 
-    def __init__(self, landscape: Landscape, pos: Vector2, velocity: Vector2, uuid: Union[UUID, None] = None, keyboard: Union[Keyboard, None] = None):
+    def __init__(self, landscape: Landscape, pos: Vector2, velocity: Vector2, uuid: Union[UUID, None] = None, controller: Union[Controller, None] = None):
+        """ If controller is None, the player takes a free keyboard (if it uses one).
+        Other controllers, like bots (see game.bots), don't take keyboards. """
         pygame.sprite.Sprite.__init__(self)
 
         self.uuid = uuid or uuid4()
 
         self.landscape = landscape
         self.pos = pos
+        self.previous_pos = Vector2(pos)
         self.velocity = velocity
 
         self.state = len(self.__states) // 2
         self.collision_box = Rect(0, 0, 15, 15)
+        self.previous_collision_box = self.collision_box.copy()
+        self.reset_collision_box()
+        self.drawn_rect = Rect(0, 0, 0, 0)
         self.time_since_last_collision = Player.INVULN_TIME
 
         self.score = 0
         self.last_scored_pair: Union[FlagPair, None] = None
+        self.next_pair_index = 0
 
-        while keyboard is None or keyboard.is_locked():
-            keyboard = get_keyboard()
+        if isinstance(controller, Keyboard) and not controller.lock():
+            controller = None
 
-        self.keyboard = keyboard
-        self.keyboard.lock()
+        if controller is None and self.uses_keyboard:
+            controller = get_keyboard()
+            assert controller is not None, "Every keyboard is taken, the player needs another controller."
+            controller.lock()
+
+        self.controller = controller
+
+    @property
+    def keyboard(self) -> Union[Keyboard, None]:
+        """ The keyboard that turns the player, if it is turned by one. """
+        return self.controller if isinstance(self.controller, Keyboard) else None
 
     @property
     def state(self):
@@ -117,22 +173,38 @@ class Player(pygame.sprite.Sprite):
                 self.landscape.world.gravity * math.cos(self.__angle_rad) ** 2
             ) - self.landscape.world.friction * self.velocity # type: ignore
 
-    def process_event(self, event: Event):
+    def turn(self, direction: int) -> bool:
+        """ Turns the player to the left (direction < 0) or to the right (direction > 0).
+        Returns whether the player was able to turn. """
         if self.time_since_last_collision < Player.DOWN_TIME:
-            return
+            return False
+
+        self.state += 1 if direction > 0 else -1
+        return True
+
+    def process_event(self, event: Event) -> int:
+        """ Turns the player with its controller. Returns the direction it turned to (see turn), 0 if it didn't. """
+        if self.controller is not None and event.type == pygame.locals.KEYDOWN:
+            direction = self.controller.process_event(event)
+            if direction != 0 and self.turn(direction):
+                if Player.turn_sound is not None:
+                    Player.turn_sound.play()
 
-        if event.type == pygame.locals.KEYDOWN:
-            if self.keyboard.is_turning_left(event):
-                self.state -= 1
-                game.assets.get_sound('turn').play()
-                return
+                return direction
 
-            if self.keyboard.is_turning_right(event):
-                self.state += 1
-                game.assets.get_sound('turn').play()
-                return
+        return 0
+
+    def interpolated_pos(self, alpha: float) -> Vector2:
+        """ Returns the position of the player between its last update (alpha = 0) and now (alpha = 1). """
+        if alpha >= 1:
+            return self.pos
+
+        return self.previous_pos.lerp(self.pos, max(alpha, 0))
 
     def update(self, dt: float):
+        self.previous_pos.update(self.pos)
+        self.previous_collision_box.update(self.collision_box)
+
         if self.time_since_last_collision >= Player.DOWN_TIME:
             self.velocity += self.acceleration * dt
             self.pos += self.velocity * dt
@@ -152,10 +224,36 @@ class Player(pygame.sprite.Sprite):
         self.collision_box.midbottom = self.rect.center
         self.collision_box.move_ip(0, 5) # Position the collision box in the right place
 
-    def render(self, camera: Camera):
-        camera.blit(self.image if self.time_since_last_collision >= Player.DOWN_TIME else Player.__down.surface, self.rect)
-        # pygame.draw.rect(camera.screen, (200, 200, 200), Rect(camera.transform(self.collision_box.topleft), (self.collision_box.width, self.collision_box.height)), 2)
-        # pygame.draw.circle(camera.screen, (0, 255, 255), camera.transform(self.rect.center), 2, 1)
+    def reset_collision_box(self):
+        """ Places the rects at the position of the player, for when it is moved without being updated.
+        The previous collision box is placed there too, so that the next step doesn't sweep the way in between. """
+        self.rect.center = (int(self.pos.x), int(self.pos.y))
+        self.collision_box.midbottom = self.rect.center
+        self.collision_box.move_ip(0, 5) # Position the collision box in the right place
+        self.previous_collision_box.update(self.collision_box)
+
+    def render_image(self) -> Surface:
+        """ Returns the image the player is drawn with, it is down for a while after a collision. """
+        return self.image if self.time_since_last_collision >= Player.DOWN_TIME else Player.__down.surface
+
+    def render_rect(self, alpha: float = 1) -> Rect:
+        """ Returns where the player is drawn (with render_image), between its last update (alpha = 0) and now (alpha = 1).
+        The same rect is reused by every call. """
+        if alpha >= 1:
+            x, y = self.pos
+        else:
+            alpha = max(alpha, 0)
+            x = self.previous_pos.x + (self.pos.x - self.previous_pos.x) * alpha
+            y = self.previous_pos.y + (self.pos.y - self.previous_pos.y) * alpha
+
+        self.drawn_rect.size = self.render_image().get_size()
+        self.drawn_rect.center = (int(x), int(y))
+        return self.drawn_rect
+
+    def render(self, camera: Camera, alpha: float = 1) -> Rect:
+        rect = self.render_rect(alpha)
+        camera.enqueue(self.render_image(), rect)
+        return rect
 
     def __eq__(self, o: object) -> bool:
         if not isinstance(o, Player):
@@ -173,8 +271,8 @@ def init():
         image = game.assets.get_image(asset)
         player_states.insert(0, (angle, image))
 
-        flipped = pygame.transform.flip(image.surface, True, False)
-        player_states.append((-angle, game.assets.Image(flipped)))
+        # The flipped states are precomputed in the atlas
+        player_states.append((-angle, game.assets.get_image(asset + game.assets.FLIPPED_SUFFIX)))
 
     Player.init(player_states, game.assets.get_image('skier-4'))
 
@@ -0,0 +1,175 @@
+""" Holds all logic related to simulating many players at once """
+import math
+from typing import List, Union
+from uuid import UUID
+
+import numpy as np
+from pygame import Vector2
+
+from game.landscape import Landscape
+from game.player import Controller, Player
+
+class PlayerPool:
+    """ Stores the physics state of many players in arrays (struct-of-arrays), so that all of them can be moved in a single vectorized step """
+    def __init__(self, landscape: Landscape, capacity: int = 64):
+        assert capacity > 0
+
+        self.landscape = landscape
+        self.players: List['PooledPlayer'] = []
+
+        self.pos = np.zeros((capacity, 2))
+        self.previous_pos = np.zeros((capacity, 2))
+        self.velocity = np.zeros((capacity, 2))
+        self.state = np.zeros(capacity, dtype=np.intp)
+        self.time_since_last_collision = np.zeros(capacity)
+
+        # The rect centers of the players, after the last update
+        self.centers: List[List[int]] = []
+
+        # The positions, velocities and times since the last collision as Python lists (kept in sync with the arrays),
+        # the players read them many times per tick and indexing an array for each read is much slower
+        self.positions: List[List[float]] = []
+        self.velocities: List[List[float]] = []
+        self.times: List[float] = []
+
+        # The acceleration due to gravity and the half width of the image only depend on the state,
+        # so they are computed once, the same way Player does it.
+        world = landscape.world
+        states = Player.get_states()
+        angles = [math.radians(angle) for angle, _ in states]
+
+        self.gravity_table = np.array([(0.5 * world.gravity * math.sin(2 * angle), world.gravity * math.cos(angle) ** 2) for angle in angles])
+        self.half_width_table = np.array([image.rect.w / 2 for _, image in states])
+
+    @property
+    def size(self):
+        return len(self.players)
+
+    def add(self, player: 'PooledPlayer') -> int:
+        """ Reserves a slot for the given player and returns its index. """
+        index = self.size
+        if index == len(self.pos):
+            self.__grow()
+
+        self.players.append(player)
+        self.centers.append([0, 0])
+        self.positions.append([0.0, 0.0])
+        self.velocities.append([0.0, 0.0])
+        self.times.append(0.0)
+        return index
+
+    def remove(self, player: 'PooledPlayer'):
+        """ Frees the slot of the given player, by moving the last player of the pool into it. """
+        index = player.index
+        last = self.size - 1
+
+        if index != last:
+            for array in (self.pos, self.previous_pos, self.velocity, self.state, self.time_since_last_collision):
+                array[index] = array[last]
+
+            moved = self.players[last]
+            moved.index = index
+            self.players[index] = moved
+            for values in (self.centers, self.positions, self.velocities, self.times):
+                values[index] = values[last]
+
+        for values in (self.players, self.centers, self.positions, self.velocities, self.times):
+            values.pop()
+
+    def __grow(self):
+        capacity = 2 * len(self.pos)
+        for name in ('pos', 'previous_pos', 'velocity', 'state', 'time_since_last_collision'):
+            array = getattr(self, name)
+
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:len(array)] = array
+            setattr(self, name, grown)
+
+    def update(self, dt: float):
+        """ Moves every player in the pool, just like Player.update would. """
+        n = self.size
+        if n == 0:
+            return
+
+        pos = self.pos[:n]
+        velocity = self.velocity[:n]
+        state = self.state[:n]
+        time_since_last_collision = self.time_since_last_collision[:n]
+
+        self.previous_pos[:n] = pos
+
+        moving = time_since_last_collision >= Player.DOWN_TIME
+        acceleration = self.gravity_table[state] - self.landscape.world.friction * velocity
+
+        velocity += np.where(moving[:, None], acceleration * dt, 0)
+        pos += np.where(moving[:, None], velocity * dt, 0)
+
+        # Same as in Player.update, the players can't fall off the screen
+        half_width = self.half_width_table[state]
+        x = pos[:, 0]
+        outside = moving & ((x < half_width) | (x > self.landscape.world.width - half_width))
+
+        x[outside] = np.minimum(np.maximum(x[outside], half_width[outside]), self.landscape.world.width - half_width[outside])
+        velocity[outside, 0] = 0
+
+        time_since_last_collision += dt
+
+        self.centers = pos.astype(np.int64).tolist()
+        self.positions = pos.tolist()
+        self.velocities = velocity.tolist()
+        self.times = time_since_last_collision.tolist()
+
+class PooledPlayer(Player):
+    """ A player whose physics state lives in a PlayerPool, it is only a view for the renderer and the input code """
+    def __init__(self, pool: PlayerPool, pos: Vector2, velocity: Vector2, uuid: Union[UUID, None] = None, controller: Union[Controller, None] = None):
+        # The pool needs to be set before Player sets the position and the velocity
+        self.pool = pool
+        self.index = pool.add(self)
+
+        super().__init__(pool.landscape, pos, velocity, uuid, controller)
+
+    @property
+    def pos(self) -> Vector2:
+        return Vector2(*self.pool.positions[self.index])
+
+    @pos.setter
+    def pos(self, pos: Vector2):
+        self.pool.pos[self.index] = self.pool.positions[self.index] = [pos[0], pos[1]]
+
+    @property
+    def previous_pos(self) -> Vector2:
+        return Vector2(self.pool.previous_pos[self.index].tolist())
+
+    @previous_pos.setter
+    def previous_pos(self, pos: Vector2):
+        self.pool.previous_pos[self.index] = (pos[0], pos[1])
+
+    @property
+    def velocity(self) -> Vector2:
+        return Vector2(*self.pool.velocities[self.index])
+
+    @velocity.setter
+    def velocity(self, velocity: Vector2):
+        self.pool.velocity[self.index] = self.pool.velocities[self.index] = [velocity[0], velocity[1]]
+
+    @property
+    def time_since_last_collision(self) -> float:
+        return self.pool.times[self.index]
+
+    @time_since_last_collision.setter
+    def time_since_last_collision(self, time: float):
+        self.pool.time_since_last_collision[self.index] = self.pool.times[self.index] = float(time)
+
+    def __set_state(self, s: int):
+        Player.state.fset(self, s) # type: ignore
+        self.pool.state[self.index] = self.state
+
+    state = property(Player.state.fget, __set_state)
+
+    def update(self, dt: float):
+        """ The pool moves the player, this only places its rects at the new position. """
+        self.previous_collision_box.update(self.collision_box)
+        self.rect.center = self.pool.centers[self.index]
+
+        self.collision_box.midbottom = self.rect.center
+        self.collision_box.move_ip(0, 5) # Position the collision box in the right place
@@ -0,0 +1,158 @@
+""" Holds all logic related to profiling frames: how long each phase of a frame takes
+and what the subsystems do in it, shown over the game or saved to a trace file """
+
+import csv
+import json
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple, Union
+
+from pygame import Rect, Surface
+
+import game.assets
+
+class Profiler:
+    """ Keeps the durations (spans) and the counters of the last frames. When it is disabled,
+    every method returns right away, so the game can always call them. """
+
+    PHASES = ["events", "update", "draw", "flip"]
+    WINDOW = 240
+    def __init__(self, window: int = WINDOW):
+        assert window > 0
+
+        self.enabled = False
+        self.window = window
+
+        # Of the current frame, in nanoseconds and in units of each counter
+        self.spans: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+
+        # The values of the last frames, a value for every frame
+        self.histories: Dict[str, Deque[int]] = {}
+        self.frames = 0
+
+        # Every frame since the trace started, if it did
+        self.trace: Union[List[Dict[str, Union[int, float]]], None] = None
+
+    def start(self) -> int:
+        """ Returns when a span starts, to be given to stop. """
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def stop(self, name: str, start: int):
+        """ Adds the time since start to the span of the current frame with the given name. """
+        if self.enabled:
+            self.spans[name] = self.spans.get(name, 0) + time.perf_counter_ns() - start
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def end_frame(self):
+        """ Moves the spans and the counters of the current frame into the histories (and the trace). """
+        if not self.enabled:
+            return
+
+        values = dict(self.spans)
+        values.update(self.counters)
+
+        # Every history has a value for every frame, even the frames that didn't have it
+        for name in values.keys() - self.histories.keys():
+            self.histories[name] = deque([0] * min(self.frames, self.window), maxlen=self.window)
+
+        for name, history in self.histories.items():
+            history.append(values.get(name, 0))
+
+        if self.trace is not None:
+            record: Dict[str, Union[int, float]] = {"frame": self.frames}
+            record.update({f"{name}_ms": span / 1e6 for name, span in self.spans.items()})
+            record.update(self.counters)
+            self.trace.append(record)
+
+        self.spans.clear()
+        self.counters.clear()
+        self.frames += 1
+
+    def stats(self, name: str) -> Tuple[float, int, int, int]:
+        """ Returns the mean, the median (p50), the p99 and the maximum of a span or counter over the last frames. """
+        history = self.histories.get(name)
+        if not history:
+            return 0, 0, 0, 0
+
+        values = sorted(history)
+        return sum(values) / len(values), values[len(values) // 2], values[min(int(len(values) * 0.99), len(values) - 1)], values[-1]
+
+    def start_trace(self):
+        """ Keeps every frame from now on (and enables the profiler), to be saved with save_trace. """
+        self.enabled = True
+        self.trace = []
+
+    def save_trace(self, path: str):
+        """ Saves the trace to a CSV file, if the path ends with .csv, or to a JSON file. """
+        trace = self.trace or []
+        if path.endswith('.csv'):
+            fields: List[str] = []
+            for record in trace:
+                fields += [field for field in record if field not in fields]
+
+            with open(path, 'w', newline='') as file:
+                writer = csv.DictWriter(file, fields, restval=0)
+                writer.writeheader()
+                writer.writerows(trace)
+        else:
+            with open(path, 'w') as file:
+                json.dump({"phases": Profiler.PHASES, "frames": trace}, file)
+
+# The profiler of the game, every part of it uses this one
+profiler = Profiler()
+
+class Overlay:
+    """ Draws the spans of the last frames over the game, as a stacked bar for each frame,
+    and the statistics of every span and counter """
+
+    COLORS = {"events": (70, 130, 180), "update": (60, 160, 90), "draw": (220, 140, 40), "flip": (180, 70, 70)}
+    TEXT_COLOR = (20, 20, 20)
+    BACKGROUND_COLOR = (255, 255, 255)
+
+    # The height of the graph is this many milliseconds, a 60 FPS frame
+    GRAPH_MILLIS = 1000 / 60
+    def __init__(self, pos: Tuple[int, int] = (8, 80), size: Tuple[int, int] = (240, 60)):
+        self.graph = Rect(pos, size)
+        self.font = game.assets.get_font("Pixeboy", 16)
+
+    def render(self, screen: Surface, profiler: Profiler) -> Rect:
+        """ Draws the overlay and returns the area of the screen it covers. """
+        lines = []
+        for name in Profiler.PHASES:
+            mean, p50, p99, _ = profiler.stats(name)
+            lines.append((f"{name} {mean / 1e6:.2f} p50 {p50 / 1e6:.2f} p99 {p99 / 1e6:.2f} ms", Overlay.COLORS[name]))
+
+        for name in sorted(profiler.histories.keys() - set(Profiler.PHASES)):
+            mean, _, _, peak = profiler.stats(name)
+            lines.append((f"{name} {mean:.0f} max {peak}", Overlay.TEXT_COLOR))
+
+        line_height = self.font.get_linesize()
+        area = Rect(self.graph.left, self.graph.top, self.graph.width, self.graph.height + 4 + line_height * len(lines))
+        screen.fill(Overlay.BACKGROUND_COLOR, area)
+
+        # A bar for every frame of the window, the newest on the right
+        histories = [(profiler.histories.get(name), color) for name, color in Overlay.COLORS.items()]
+        scale = self.graph.height / (Overlay.GRAPH_MILLIS * 1e6)
+        frames = min(profiler.frames, profiler.window, self.graph.width)
+        for i in range(frames):
+            x = self.graph.right - frames + i
+            bottom = self.graph.bottom
+            for history, color in histories:
+                if history is None:
+                    continue
+
+                height = min(int(history[len(history) - frames + i] * scale), bottom - self.graph.top)
+                if height > 0:
+                    screen.fill(color, (x, bottom - height, 1, height))
+                    bottom -= height
+
+        y = self.graph.bottom + 4
+        for text, color in lines:
+            screen.blit(self.font.render(text, False, color), (self.graph.left, y))
+            y += line_height
+
+        return area
@@ -0,0 +1,245 @@
+""" Holds the binary messages exchanged by the multiplayer server (see game.server) and its clients
+
+Every message is a datagram, that starts with its type (a byte). Every number is a varint
+(see game.utils.write_varint) and the signed ones are zigzag-encoded first:
+    - JOIN (client): the version of the protocol;
+    - WELCOME (server): the id and the uuid (16 bytes) of the client's player, the tick rate
+      and, as JSON, the seed and the parameters of the world, to generate the same landscape;
+    - REJECT (server): the race is full;
+    - INPUT (client): the last snapshot received, plus one (0 for none), and the inputs that were
+      not acknowledged yet, as (sequence, tick, direction);
+    - LEAVE (client): nothing;
+    - SNAPSHOT (server): the tick, the snapshot it is encoded against, plus one (0 for none),
+      the last input of the client that was applied, whether the race ended, the ids of the
+      players that left and the players that changed.
+
+The players of a snapshot only hold the fields that changed since the snapshot it is
+encoded against (delta compression), as fixed-point numbers, so that both ends agree on them exactly.
+"""
+
+import json
+from bisect import bisect_left
+from typing import Dict, List, NamedTuple, Tuple, Union
+from uuid import UUID
+
+from pygame import Vector2
+
+from game.landscape import Landscape
+from game.player import Player
+from game.utils import read_varint, unzigzag, write_varint, zigzag
+
+VERSION = 1
+
+JOIN = 1
+WELCOME = 2
+REJECT = 3
+INPUT = 4
+LEAVE = 5
+SNAPSHOT = 6
+
+# Positions, velocities and times are sent in 1/QUANTUM units
+QUANTUM = 1024
+
+Input = Tuple[int, int, int] # sequence, tick, direction
+
+class PlayerState(NamedTuple):
+    """ The state of a player in a snapshot, as fixed-point numbers """
+    x: int
+    y: int
+    vx: int
+    vy: int
+    state: int
+    time_since_last_collision: int
+    score: int
+    last_scored_y: int # y of the last scored pair plus one, 0 for none
+
+    @staticmethod
+    def capture(player: Player) -> 'PlayerState':
+        pos, velocity = player.pos, player.velocity
+        pair = player.last_scored_pair
+
+        # After INVULN_TIME, the time since the last collision doesn't change anything,
+        # so it stops changing in the snapshots too
+        time = min(player.time_since_last_collision, Player.INVULN_TIME)
+
+        return PlayerState(
+            round(pos.x * QUANTUM), round(pos.y * QUANTUM),
+            round(velocity.x * QUANTUM), round(velocity.y * QUANTUM),
+            player.state, round(time * QUANTUM),
+            player.score, pair.y + 1 if pair is not None else 0
+        )
+
+    def restore(self, player: Player, landscape: Landscape):
+        """ Puts the player in this state, as if it had been updated into it. """
+        # The state rotates the velocity, so it is set first
+        player.state = self.state
+        player.pos = Vector2(self.x / QUANTUM, self.y / QUANTUM)
+        player.velocity = Vector2(self.vx / QUANTUM, self.vy / QUANTUM)
+        player.time_since_last_collision = self.time_since_last_collision / QUANTUM
+        player.score = self.score
+
+        player.last_scored_pair = None
+        if self.last_scored_y > 0:
+            index = bisect_left(landscape.flag_pair_ys, self.last_scored_y - 1)
+            if index < len(landscape.flag_pairs):
+                player.last_scored_pair = landscape.flag_pairs[index]
+
+        player.reset_collision_box()
+
+EMPTY_STATE = PlayerState(0, 0, 0, 0, 0, 0, 0, 0)
+
+class Snapshot:
+    """ The state of every player of a race, at a tick of the server """
+    def __init__(self, tick: int, players: Dict[int, PlayerState], uuids: Dict[int, UUID], ended: bool = False):
+        self.tick = tick
+        self.players = players
+        self.uuids = uuids
+        self.ended = ended
+
+def encode_join() -> bytes:
+    return bytes((JOIN, VERSION))
+
+def encode_welcome(id: int, uuid: UUID, tick_rate: int, seed: Union[int, str], params: dict) -> bytes:
+    data = bytearray((WELCOME,))
+    write_varint(data, id)
+    data += uuid.bytes
+    write_varint(data, tick_rate)
+
+    world = json.dumps({"seed": seed, "world": params}).encode()
+    write_varint(data, len(world))
+    data += world
+    return bytes(data)
+
+def decode_welcome(data: bytes) -> Tuple[int, UUID, int, Union[int, str], dict]:
+    """ Returns the id and the uuid of the player, the tick rate, the seed and the parameters of the world. """
+    id, offset = read_varint(data, 1)
+    uuid = UUID(bytes=bytes(data[offset:offset + 16]))
+    tick_rate, offset = read_varint(data, offset + 16)
+
+    length, offset = read_varint(data, offset)
+    world = json.loads(bytes(data[offset:offset + length]).decode())
+    return id, uuid, tick_rate, world["seed"], world["world"]
+
+def encode_reject() -> bytes:
+    return bytes((REJECT,))
+
+def encode_input(ack: Union[int, None], inputs: List[Input]) -> bytes:
+    data = bytearray((INPUT,))
+    write_varint(data, ack + 1 if ack is not None else 0)
+    write_varint(data, len(inputs))
+    for sequence, tick, direction in inputs:
+        write_varint(data, sequence)
+        write_varint(data, tick)
+        write_varint(data, zigzag(direction))
+
+    return bytes(data)
+
+def decode_input(data: bytes) -> Tuple[Union[int, None], List[Input]]:
+    """ Returns the last snapshot received by the client and its inputs. """
+    ack, offset = read_varint(data, 1)
+    count, offset = read_varint(data, offset)
+
+    inputs = []
+    for _ in range(count):
+        sequence, offset = read_varint(data, offset)
+        tick, offset = read_varint(data, offset)
+        direction, offset = read_varint(data, offset)
+        inputs.append((sequence, tick, unzigzag(direction)))
+
+    return ack - 1 if ack > 0 else None, inputs
+
+def encode_leave() -> bytes:
+    return bytes((LEAVE,))
+
+def encode_snapshot_body(snapshot: Snapshot, baseline: Union[Snapshot, None]) -> bytes:
+    """ Encodes the players of the snapshot that changed since the baseline. The body doesn't depend
+    on the client, so it can be shared by every client that has the same baseline. """
+    base_players = baseline.players if baseline is not None else {}
+
+    data = bytearray()
+    removed = [id for id in base_players if id not in snapshot.players]
+    write_varint(data, len(removed))
+    for id in removed:
+        write_varint(data, id)
+
+    entries = bytearray()
+    count = 0
+    for id, state in snapshot.players.items():
+        base = base_players.get(id)
+        if base == state:
+            continue
+
+        mask = 0
+        fields = bytearray()
+        for i, value in enumerate(state):
+            base_value = base[i] if base is not None else 0
+            if value != base_value:
+                mask |= 1 << i
+                write_varint(fields, zigzag(value - base_value))
+
+        write_varint(entries, id)
+        entries.append(mask)
+        if base is None:
+            entries += snapshot.uuids[id].bytes
+        entries += fields
+        count += 1
+
+    write_varint(data, count)
+    data += entries
+    return bytes(data)
+
+def encode_snapshot(snapshot: Snapshot, baseline: Union[Snapshot, None], last_sequence: int, body: Union[bytes, None] = None) -> bytes:
+    data = bytearray((SNAPSHOT,))
+    write_varint(data, snapshot.tick)
+    write_varint(data, baseline.tick + 1 if baseline is not None else 0)
+    write_varint(data, last_sequence)
+    data.append(1 if snapshot.ended else 0)
+
+    data += body if body is not None else encode_snapshot_body(snapshot, baseline)
+    return bytes(data)
+
+def decode_snapshot(data: bytes, baselines: Dict[int, Snapshot]) -> Union[Tuple[Snapshot, int], None]:
+    """ Decodes a snapshot against one of the given snapshots (by tick), previously received.
+    Returns it and the last input that was applied, or None if its baseline isn't known (anymore). """
+    tick, offset = read_varint(data, 1)
+    baseline_tick, offset = read_varint(data, offset)
+    last_sequence, offset = read_varint(data, offset)
+    ended = data[offset] != 0
+    offset += 1
+
+    baseline = None
+    if baseline_tick > 0:
+        baseline = baselines.get(baseline_tick - 1)
+        if baseline is None:
+            return None
+
+    players = dict(baseline.players) if baseline is not None else {}
+    uuids = dict(baseline.uuids) if baseline is not None else {}
+
+    removed, offset = read_varint(data, offset)
+    for _ in range(removed):
+        id, offset = read_varint(data, offset)
+        players.pop(id, None)
+        uuids.pop(id, None)
+
+    count, offset = read_varint(data, offset)
+    for _ in range(count):
+        id, offset = read_varint(data, offset)
+        mask = data[offset]
+        offset += 1
+
+        base = players.get(id)
+        if base is None:
+            uuids[id] = UUID(bytes=bytes(data[offset:offset + 16]))
+            offset += 16
+            base = EMPTY_STATE
+
+        values = list(base)
+        for i in range(len(values)):
+            if mask & (1 << i):
+                delta, offset = read_varint(data, offset)
+                values[i] += unzigzag(delta)
+
+        players[id] = PlayerState(*values)
+
+    return Snapshot(tick, players, uuids, ended), last_sequence
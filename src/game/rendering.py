@@ -1,17 +1,33 @@
+from bisect import bisect_right
+from collections import OrderedDict
+
+from typing import List, Union
 
 import pygame.display
+import pygame.locals
 from pygame import Rect, Surface
+from pygame.event import Event
 
-import game.assets
-import game.utils
 from game.camera import Camera
+from game.hud import Hud
+from game.landscape import Obstacle
+from game.profiler import Overlay, profiler
 
 class Renderer:
 
     BACKGROUND_COLOR = (245, 245, 245)
 
+    # The landscape never moves, so it is drawn once into tiles as wide as the screen,
+    # which are kept in a LRU cache while they are needed.
+    TILE_HEIGHT = 256
+    MAX_TILES = 8
+
+    DIRTY_RECTS_KEY = pygame.locals.K_F2
+    PROFILER_KEY = pygame.locals.K_F3
+
     def __init__(self, screen: Surface):
         self.screen = screen
+        self.screen_rect = screen.get_rect()
         self.camera = Camera(screen, 200, 150)
 
         self.background = Surface(screen.get_size())
@@ -20,50 +36,296 @@ class Renderer:
 
         self.header = Rect(0, 0, 800, 75)
 
-        self.points_font = game.assets.get_font("Pixeboy", 48)
-        self.time_font = game.assets.get_font("Pixeboy", 32)
+        self.tiles: OrderedDict[int, Surface] = OrderedDict()
+        self.max_tiles = Renderer.MAX_TILES
+        self.tiles_landscape = None
+        self.tiles_version = -1
+
+        self.hud = Hud(self.header, Renderer.BACKGROUND_COLOR)
+
+        # What was drawn in the last frame, used to only draw again what changed
+        self.dirty_rects = False
+        self.last_offset: Union[int, None] = None
+        self.last_rects: List[Rect] = []
+
+        # Reused every frame, to avoid allocating new lists
+        self.player_rects: List[Rect] = []
+        self.overlays: List[Obstacle] = []
+
+        # Created the first time it is shown
+        self.show_profiler = False
+        self.profiler_overlay: Union[Overlay, None] = None
+
+    def get_tile(self, landscape, index: int) -> Surface:
+        """ Returns the tile of the landscape between the y values index * TILE_HEIGHT and (index + 1) * TILE_HEIGHT. """
+        # If the landscape changes (or is replaced), the tiles no longer match it
+        if landscape is not self.tiles_landscape or landscape.version != self.tiles_version:
+            self.tiles.clear()
+            self.tiles_landscape = landscape
+            self.tiles_version = landscape.version
+
+        tile = self.tiles.get(index)
+        if tile is not None:
+            self.tiles.move_to_end(index)
+            return tile
+
+        profiler.count("tiles_rendered")
+        # As wide as the landscape, so that the viewports of a split screen can share them
+        tile = Surface((max(self.screen.get_width(), int(landscape.width)), Renderer.TILE_HEIGHT)).convert()
+        tile.fill(Renderer.BACKGROUND_COLOR)
+
+        top = index * Renderer.TILE_HEIGHT
+        bottom = top + Renderer.TILE_HEIGHT
+
+        camera = Camera(tile, 0, 0)
+        camera.offset = -top
+
+        pairs_start, pairs_end = landscape.flag_pairs_between(top, bottom)
+        for i in range(pairs_start, pairs_end):
+            landscape.flag_pairs[i].render(camera)
+
+        trees_start, trees_end = landscape.trees_between(top, bottom)
+        for i in range(trees_start, trees_end):
+            landscape.trees[i].render(camera)
+
+        camera.flush()
+
+        self.tiles[index] = tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+
+        return tile
+
+    def add_overlay(self, obstacle, rects, camera: Camera):
+        """ Adds the obstacle to the overlays and clears it from the camera's screen, if it overlaps any of the given rects. """
+        rect = obstacle.rect
+        if rect.collidelist(rects) != -1:
+            camera.screen.fill(Renderer.BACKGROUND_COLOR, rect.move(camera.offset_x, camera.offset))
+            self.overlays.append(obstacle)
+
+    def set_dirty_rects(self, enabled: bool):
+        """ Switches between presenting only the parts of the screen that changed (dirty rectangles) and the whole screen. """
+        self.dirty_rects = enabled
+        self.last_offset = None
+
+    def process_event(self, event: Event):
+        if event.type == pygame.locals.KEYDOWN and event.key == Renderer.DIRTY_RECTS_KEY:
+            self.set_dirty_rects(not self.dirty_rects)
+        elif event.type == pygame.locals.KEYDOWN and event.key == Renderer.PROFILER_KEY:
+            self.set_show_profiler(not self.show_profiler)
+
+    def set_show_profiler(self, enabled: bool):
+        """ Shows or hides the profiler's overlay, the profiler only measures the frames while it is needed. """
+        self.show_profiler = enabled
+        profiler.enabled = enabled or profiler.trace is not None
+        if enabled and self.profiler_overlay is None:
+            self.profiler_overlay = Overlay()
+
+        # The whole screen is drawn again, so that the overlay is cleared
+        self.last_offset = None
+
+    def repaint(self, landscape, rect: Rect, camera: Union[Camera, None] = None):
+        """ Draws the landscape's tiles over the given area of the screen (of the camera, the main one by default). """
+        camera = camera or self.camera
+        screen = camera.screen
+
+        clip = screen.get_clip()
+        screen.set_clip(rect)
+
+        top = rect.top - camera.offset
+        bottom = rect.bottom - camera.offset
+        for index in range(top // Renderer.TILE_HEIGHT, (bottom - 1) // Renderer.TILE_HEIGHT + 1):
+            camera.enqueue(self.get_tile(landscape, index), (0, index * Renderer.TILE_HEIGHT))
+
+        camera.flush()
+        screen.set_clip(clip)
+
+    def scroll(self, landscape, dy: int) -> List[Rect]:
+        """ Moves what is on the screen by dy, instead of drawing it again,
+        and restores the landscape where the sprites of the last frame were.
+        Returns the areas of the screen that were drawn again. """
+        width, height = self.screen.get_size()
+        restored = [rect.move(0, dy) for rect in self.last_rects]
+
+        if dy < 0:
+            self.screen.scroll(0, dy)
+            restored.append(Rect(0, height + dy, width, -dy))
+        elif dy > 0:
+            # The header moves down with everything else, so the area below it is restored too
+            self.screen.scroll(0, dy)
+            restored.append(Rect(0, 0, width, self.header.bottom + dy))
+
+        for rect in restored:
+            self.repaint(landscape, rect)
+
+        return restored
 
-    def render(self, obj):
+    def draw_sprites(self, camera: Camera, landscape, players, main_y: float, top: float, bottom: float, alpha: float):
+        """ Draws the players, and the obstacles in front of them, between the y values top and bottom,
+        over the tiles that are already on the camera's screen. """
+        # Obstacles below the main player appear in front of the players,
+        # so the ones the players are drawn over need to be drawn again, on top of them.
+        # Obstacles never overlap each other, so their place in the tile can be cleared
+        # before drawing the players, in order to not draw them twice.
+        self.player_rects.clear()
+        for player in players:
+            self.player_rects.append(player.render_rect(alpha))
+
+        pairs_start, pairs_end = landscape.flag_pairs_between(top, bottom)
+        pairs_split = bisect_right(landscape.flag_pair_ys, main_y, pairs_start, pairs_end)
+
+        trees_start, trees_end = landscape.trees_between(top, bottom)
+        trees_split = bisect_right(landscape.tree_bottoms, main_y, trees_start, trees_end)
+
+        profiler.count("obstacles_culled", len(landscape.flag_pairs) - (pairs_end - pairs_start) + len(landscape.trees) - (trees_end - trees_start))
+
+        self.overlays.clear()
+        for i in range(pairs_split, pairs_end):
+            pair = landscape.flag_pairs[i]
+            self.add_overlay(pair.left, self.player_rects, camera)
+            self.add_overlay(pair.right, self.player_rects, camera)
+
+        for i in range(trees_split, trees_end):
+            self.add_overlay(landscape.trees[i], self.player_rects, camera)
+
+        # Every layer is drawn with a single call
+        for player in players:
+            player.render(camera, alpha)
+
+        camera.flush()
+
+        for obstacle in self.overlays:
+            obstacle.render(camera)
+
+        camera.flush()
+
+    def render(self, obj, alpha: float = 1):
+        """ Draws a frame of the game, alpha is how far it is between the last physics step (0) and the next one (1). """
+        start = profiler.start()
         main_player = obj.get_main_player()
+        main_pos = main_player.interpolated_pos(alpha)
+
+        self.camera.track(main_pos)
+
+        landscape = obj.landscape
+        top = -self.camera.offset
+        bottom = top + self.screen.get_height()
+
+        dy = self.camera.offset - self.last_offset if self.last_offset is not None else None
+
+        dirty = None
+        if not self.dirty_rects or dy is None or abs(dy) >= self.screen_rect.height or landscape is not self.tiles_landscape or landscape.version != self.tiles_version:
+            self.repaint(landscape, self.screen_rect)
+        else:
+            dirty = self.scroll(landscape, dy)
+
+        self.draw_sprites(self.camera, landscape, obj.players, main_pos.y, top, bottom, alpha)
+
+        hud_rect = self.hud.render(self.screen, obj, main_player)
+
+        self.last_offset = self.camera.offset
+        if self.dirty_rects:
+            self.last_rects = [rect.move(0, self.camera.offset) for rect in self.player_rects]
+            self.last_rects += [obstacle.rect.move(0, self.camera.offset) for obstacle in self.overlays]
+
+        if self.show_profiler and self.profiler_overlay is not None:
+            profiler_rect = self.profiler_overlay.render(self.screen, profiler)
+
+            # Restored like the sprites, in the next frame
+            if self.dirty_rects:
+                self.last_rects.append(profiler_rect)
+
+        profiler.stop("draw", start)
+
+        start = profiler.start()
+        if dirty is None or dy != 0:
+            # When the screen scrolls, every pixel of it changes
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty + self.last_rects + [hud_rect])
+
+        profiler.stop("flip", start)
+
+class Viewport:
+    """ The part of a split screen that follows a player, with its own camera and HUD """
+    def __init__(self, screen: Surface, rect: Rect, player: int):
+        self.rect = rect
+        self.player = player
+        self.surface = screen.subsurface(rect)
+
+        # Placed like the camera of a whole screen, for the height of the viewport
+        self.camera = Camera(self.surface, rect.height // 3, rect.height // 4)
+        self.hud = Hud(Rect(0, 0, rect.width, SplitScreenRenderer.HEADER_HEIGHT), Renderer.BACKGROUND_COLOR)
+
+class SplitScreenRenderer(Renderer):
+    """ Splits the screen into a viewport for each local player (the first players of the game):
+    side by side for two players and in a grid for three or four. The viewports share the tiles of the landscape,
+    which are as wide as the landscape, and follow their players horizontally when they are narrower than it. """
+
+    MAX_VIEWPORTS = 4
+    HEADER_HEIGHT = 75
+    BORDER_COLOR = (40, 40, 40)
+
+    # Every viewport shows about three tiles at a time
+    TILES_PER_VIEWPORT = 4
+    def __init__(self, screen: Surface, viewports: int):
+        assert 0 < viewports <= SplitScreenRenderer.MAX_VIEWPORTS
+
+        super().__init__(screen)
+
+        width, height = screen.get_size()
+        columns = 1 if viewports == 1 else 2
+        rows = 1 if viewports <= 2 else 2
+        cell_width, cell_height = width // columns, height // rows
 
-        self.screen.blit(self.background, (0, 0))
-        self.camera.track(main_player.pos)
+        cells = [Rect(column * cell_width, row * cell_height, cell_width, cell_height) for row in range(rows) for column in range(columns)]
+        self.viewports = [Viewport(screen, cell, i) for i, cell in enumerate(cells[:viewports])]
 
-        defered_render = []
-        for pair in obj.landscape.flag_pairs:
-            if pair.y > main_player.pos.y:
-                defered_render.append(pair)
-                continue
+        # The cells without a viewport (with three players) and the lines between the viewports
+        self.spare = cells[viewports:]
+        self.borders = [Rect(column * cell_width - 1, 0, 2, height) for column in range(1, columns)]
+        self.borders += [Rect(0, row * cell_height - 1, width, 2) for row in range(1, rows)]
 
-            pair.render(self.camera)
+        self.max_tiles = max(Renderer.MAX_TILES, SplitScreenRenderer.TILES_PER_VIEWPORT * viewports)
 
-        for tree in obj.landscape.trees:
-            if tree.rect.bottom > main_player.pos.y:
-                defered_render.append(tree)
-                continue
+    def set_dirty_rects(self, enabled: bool):
+        """ A split screen is always presented whole, every viewport scrolls on its own. """
+        self.dirty_rects = False
+        self.last_offset = None
 
-            tree.render(self.camera)
+    def render(self, obj, alpha: float = 1):
+        """ Draws a frame of the game in every viewport. """
+        start = profiler.start()
+        landscape = obj.landscape
+        players = obj.players
 
-        for player in obj.players:
-            player.render(self.camera)
+        for viewport in self.viewports:
+            player = players[viewport.player] if viewport.player < len(players) else obj.get_main_player()
+            pos = player.interpolated_pos(alpha)
 
-        for defered in defered_render:
-            defered.render(self.camera)
+            camera = viewport.camera
+            camera.track(pos)
+            camera.track_x(pos.x, landscape.width)
 
-        self.screen.blit(self.background, (0, 0), self.header)
+            # The same y-sorted obstacles are culled for every viewport, nothing is copied
+            top = -camera.offset
+            bottom = top + viewport.rect.height
+            self.repaint(landscape, viewport.surface.get_rect(), camera)
+            self.draw_sprites(camera, landscape, players, pos.y, top, bottom, alpha)
 
-        time = self.time_font.render(game.utils.format_millis(obj.game_millis), True, (0, 0, 0), Renderer.BACKGROUND_COLOR)
-        time_rect = time.get_rect()
+            viewport.hud.render(viewport.surface, obj, player)
 
-        points = self.points_font.render(str(obj.landscape.world.flags_ammount - obj.get_main_player().score), True, (0, 0, 0), Renderer.BACKGROUND_COLOR)
-        points_rect = points.get_rect()
+        for rect in self.spare:
+            self.screen.fill(Renderer.BACKGROUND_COLOR, rect)
 
-        points_rect.midbottom = self.header.center
-        time_rect.midtop = self.header.center
+        for rect in self.borders:
+            self.screen.fill(SplitScreenRenderer.BORDER_COLOR, rect)
 
-        time_rect.move_ip(0, 10)
+        if self.show_profiler and self.profiler_overlay is not None:
+            self.profiler_overlay.render(self.screen, profiler)
 
-        self.screen.blit(time, time_rect)
-        self.screen.blit(points, points_rect)
+        profiler.stop("draw", start)
 
+        start = profiler.start()
         pygame.display.flip()
+        profiler.stop("flip", start)
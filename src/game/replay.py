@@ -0,0 +1,404 @@
+""" Handles recording races and playing them again (replays)
+
+The physics of a race only depend on its landscape, its world, where its players start and when they turn,
+so that is all a replay holds. The format is made of (see game.utils.write_varint):
+    - the magic bytes and the version of the format;
+    - the tick rate and the kind of landscape, with its seed (or the path of its course file);
+    - the parameters of the world and the starting position of every player, as numbers;
+    - the number of ticks the race took, the score of every player and a checksum
+      (CRC-32, 4 bytes) of where the players ended;
+    - the turns, as (ticks since the last turn, player index * 2 + (1 if right else 0)) pairs.
+
+A number is a byte telling if it is an int (written as a zigzag varint) or a float (8 bytes).
+"""
+
+import argparse
+import struct
+import zlib
+from typing import Dict, List, Tuple, Union
+
+import pygame.event
+import pygame.locals
+import pygame.time
+from pygame import Rect, Vector2
+
+import game
+import game.player
+import game.utils
+from game.config import WorldConfig
+from game.course import CourseLandscape
+from game.landscape import ChunkedLandscape, Landscape, LocalLandscape
+from game.player import Player
+from game.utils import read_varint, unzigzag, write_varint, zigzag
+
+MAGIC = b'SKIR'
+VERSION = 1
+
+LOCAL = 0
+CHUNKED = 1
+COURSE = 2
+
+INT = 0
+FLOAT = 1
+STRING = 2
+
+DOUBLE = struct.Struct('<d')
+CHECKSUM = struct.Struct('<I')
+
+# The parameters of the world, in the order they are saved
+PARAMS = ["width", "height", "difficulty", "gravity", "inclination", "friction", "trees_margin_to_flags"]
+LIST_PARAMS = [("flags", 4), ("ammounts", 2)]
+
+Turn = Tuple[int, int, int] # tick, player index, direction
+
+class ReplayPlayer(Player):
+    """ A player of a replay, turned by the replay instead of a keyboard """
+    uses_keyboard = False
+
+class Replay:
+    """ Everything needed to simulate a race again, and the result it should have """
+    def __init__(self, kind: int, source: Union[int, str, Tuple[Union[int, str], int, bool]], params: dict, tick_rate: int, starts: List[Tuple[float, float]]):
+        """ The source of the landscape is its seed (LOCAL), its (seed, chunk_height, endless) (CHUNKED) or the path of its file (COURSE). """
+        self.kind = kind
+        self.source = source
+        self.params = params
+        self.tick_rate = tick_rate
+        self.starts = starts
+
+        self.turns: List[Turn] = []
+
+        # The result of the race, once it is finished
+        self.ticks = 0
+        self.scores: List[int] = []
+        self.checksum = 0
+
+    @staticmethod
+    def of(obj: 'game.Game') -> 'Replay':
+        """ Starts recording the given game, which must not have started yet. """
+        landscape = obj.landscape
+        if isinstance(landscape, CourseLandscape):
+            kind, source = COURSE, landscape.path
+        elif isinstance(landscape, ChunkedLandscape):
+            kind, source = CHUNKED, (landscape.seed, landscape.chunk_height, landscape.endless)
+        elif isinstance(landscape, LocalLandscape) and landscape.seed is not None:
+            kind, source = LOCAL, landscape.seed
+        else:
+            raise ValueError("Only landscapes with a seed or a course file can be replayed.")
+
+        replay = Replay(kind, source, landscape.world.params, obj.tick_rate, [(player.pos.x, player.pos.y) for player in obj.players])
+        obj.replay = replay
+        return replay
+
+    def record(self, tick: int, player: int, direction: int):
+        """ Records that a player turned before the given tick. """
+        self.turns.append((tick, player, 1 if direction > 0 else -1))
+
+    def finish(self, obj: 'game.Game'):
+        """ Records the result of the game. """
+        self.ticks = obj.tick
+        self.scores = [player.score for player in obj.players]
+        self.checksum = checksum(obj)
+
+    def new_landscape(self) -> Landscape:
+        world = WorldConfig(self.params)
+        if self.kind == LOCAL:
+            return LocalLandscape(world, self.source) # type: ignore
+        if self.kind == CHUNKED:
+            seed, chunk_height, endless = self.source # type: ignore
+            return ChunkedLandscape(world, seed, chunk_height, endless)
+
+        return CourseLandscape(self.source) # type: ignore
+
+    def new_game(self) -> 'game.Game':
+        """ Returns a headless game, just like the one that was recorded before it started. """
+        landscape = self.new_landscape()
+        players = [ReplayPlayer(landscape, Vector2(x, y), Vector2(0, 0)) for x, y in self.starts]
+
+        obj = game.Game(None, landscape, *players, tick_rate=self.tick_rate)
+
+        # The countdown places the players, before the race starts
+        obj.simulate(0)
+        obj.game_millis = 0
+        return obj
+
+    def to_bytes(self) -> bytes:
+        data = bytearray(MAGIC)
+        data.append(VERSION)
+        write_varint(data, self.tick_rate)
+
+        data.append(self.kind)
+        if self.kind == CHUNKED:
+            seed, chunk_height, endless = self.source # type: ignore
+            write_value(data, seed)
+            write_varint(data, chunk_height)
+            data.append(1 if endless else 0)
+        else:
+            write_value(data, self.source) # type: ignore
+
+        for name in PARAMS:
+            write_value(data, self.params[name])
+        for name, length in LIST_PARAMS:
+            for value in self.params[name][:length]:
+                write_value(data, value)
+
+        write_varint(data, len(self.starts))
+        for x, y in self.starts:
+            write_value(data, x)
+            write_value(data, y)
+
+        write_varint(data, self.ticks)
+        for score in self.scores:
+            write_varint(data, score)
+        data += CHECKSUM.pack(self.checksum)
+
+        write_varint(data, len(self.turns))
+        last_tick = 0
+        for tick, player, direction in self.turns:
+            write_varint(data, tick - last_tick)
+            write_varint(data, 2 * player + (1 if direction > 0 else 0))
+            last_tick = tick
+
+        return bytes(data)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> 'Replay':
+        if data[:4] != MAGIC:
+            raise ValueError("This is not a replay.")
+
+        if data[4] != VERSION:
+            raise ValueError(f"This replay has version {data[4]} of the format, but only version {VERSION} is supported.")
+
+        tick_rate, offset = read_varint(data, 5)
+
+        kind = data[offset]
+        offset += 1
+        if kind == CHUNKED:
+            seed, offset = read_value(data, offset)
+            chunk_height, offset = read_varint(data, offset)
+            source = (seed, chunk_height, data[offset] != 0)
+            offset += 1
+        else:
+            source, offset = read_value(data, offset)
+
+        params = {}
+        for name in PARAMS:
+            params[name], offset = read_value(data, offset)
+        for name, length in LIST_PARAMS:
+            params[name] = []
+            for _ in range(length):
+                value, offset = read_value(data, offset)
+                params[name].append(value)
+
+        count, offset = read_varint(data, offset)
+        starts = []
+        for _ in range(count):
+            x, offset = read_value(data, offset)
+            y, offset = read_value(data, offset)
+            starts.append((x, y))
+
+        replay = Replay(kind, source, params, tick_rate, starts)
+
+        replay.ticks, offset = read_varint(data, offset)
+        for _ in range(count):
+            score, offset = read_varint(data, offset)
+            replay.scores.append(score)
+
+        replay.checksum, = CHECKSUM.unpack_from(data, offset)
+        offset += CHECKSUM.size
+
+        turns, offset = read_varint(data, offset)
+        tick = 0
+        for _ in range(turns):
+            delta, offset = read_varint(data, offset)
+            value, offset = read_varint(data, offset)
+
+            tick += delta
+            replay.turns.append((tick, value // 2, 1 if value % 2 == 1 else -1))
+
+        return replay
+
+    def save(self, path: str):
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+
+def checksum(obj: 'game.Game') -> int:
+    """ Returns a checksum of the positions and velocities of the players of the game. """
+    values = [value for player in obj.players for value in (*player.pos, *player.velocity)]
+    return zlib.crc32(struct.pack(f'<{len(values)}d', *values))
+
+def load_replay(path: str) -> Replay:
+    with open(path, 'rb') as file:
+        return Replay.from_bytes(file.read())
+
+def write_value(data: bytearray, value: Union[int, float, str]):
+    if isinstance(value, str):
+        encoded = value.encode()
+        data.append(STRING)
+        write_varint(data, len(encoded))
+        data += encoded
+    elif isinstance(value, float) and not value.is_integer():
+        data.append(FLOAT)
+        data += DOUBLE.pack(value)
+    else:
+        data.append(INT)
+        write_varint(data, zigzag(int(value)))
+
+def read_value(data: bytes, offset: int) -> Tuple[Union[int, float, str], int]:
+    kind = data[offset]
+    if kind == STRING:
+        length, offset = read_varint(data, offset + 1)
+        return bytes(data[offset:offset + length]).decode(), offset + length
+
+    if kind == FLOAT:
+        return DOUBLE.unpack_from(data, offset + 1)[0], offset + 1 + DOUBLE.size
+
+    value, offset = read_varint(data, offset + 1)
+    return unzigzag(value), offset
+
+class Checkpoint:
+    """ The state of a game (and of its players) at a tick, to go back to it without simulating from the start """
+    def __init__(self, obj: 'game.Game', turn_index: int):
+        self.tick = obj.tick
+        self.game_millis = obj.game_millis
+        self.running = obj.running
+        self.turn_index = turn_index
+
+        self.players = [(
+            Vector2(player.pos), Vector2(player.previous_pos), Vector2(player.velocity), player.state,
+            player.time_since_last_collision, player.score, player.last_scored_pair, player.next_pair_index,
+            Rect(player.rect), Rect(player.collision_box), Rect(player.previous_collision_box)
+        ) for player in obj.players]
+
+    def restore(self, obj: 'game.Game'):
+        obj.tick = self.tick
+        obj.game_millis = self.game_millis
+        obj.running = self.running
+
+        for player, state in zip(obj.players, self.players):
+            pos, previous_pos, velocity, s, time, score, pair, cursor, rect, box, previous_box = state
+
+            # The state rotates the velocity, so it is set first
+            player.state = s
+            player.pos = Vector2(pos)
+            player.previous_pos = Vector2(previous_pos)
+            player.velocity = Vector2(velocity)
+            player.time_since_last_collision = time
+            player.score = score
+            player.last_scored_pair = pair
+            player.next_pair_index = cursor
+            player.rect.update(rect)
+            player.collision_box.update(box)
+            player.previous_collision_box.update(previous_box)
+
+class Playback:
+    """ Plays a replay, tick by tick, and seeks to any tick of it. A checkpoint is kept
+    every checkpoint_interval ticks, so seeking only simulates from the closest one. """
+
+    CHECKPOINT_INTERVAL = 600
+    SEEK_SECONDS = 5
+    def __init__(self, replay: Replay, checkpoint_interval: int = CHECKPOINT_INTERVAL):
+        assert checkpoint_interval > 0
+
+        self.replay = replay
+        self.checkpoint_interval = checkpoint_interval
+
+        self.game = replay.new_game()
+        self.turn_index = 0
+        self.checkpoints: Dict[int, Checkpoint] = {0: Checkpoint(self.game, 0)}
+
+    @property
+    def tick(self) -> int:
+        return self.game.tick
+
+    def advance(self) -> bool:
+        """ Simulates the next tick of the replay. Returns whether the race is still running. """
+        obj = self.game
+        if not obj.running:
+            return False
+
+        turns = self.replay.turns
+        while self.turn_index < len(turns) and turns[self.turn_index][0] <= obj.tick:
+            _, player, direction = turns[self.turn_index]
+            obj.players[player].turn(direction)
+            self.turn_index += 1
+
+        running = obj.step(1000 / obj.tick_rate * obj.landscape.world.time_factor)
+
+        if obj.tick % self.checkpoint_interval == 0 and obj.tick not in self.checkpoints:
+            self.checkpoints[obj.tick] = Checkpoint(obj, self.turn_index)
+
+        return running
+
+    def seek(self, tick: int):
+        """ Puts the game at the given tick (or at the end of the race, if it ended before). """
+        tick = max(tick, 0)
+
+        # The closest checkpoint is only used if it's closer than the current tick
+        closest = max(t for t in self.checkpoints if t <= tick)
+        if tick < self.tick or closest > self.tick:
+            checkpoint = self.checkpoints[closest]
+            checkpoint.restore(self.game)
+            self.turn_index = checkpoint.turn_index
+
+        while self.tick < tick and self.advance():
+            pass
+
+    def run(self) -> 'game.Game':
+        """ Simulates the rest of the race, as fast as possible. """
+        while self.advance():
+            pass
+
+        return self.game
+
+    def start(self, renderer):
+        """ Shows the replay at the speed it was played, the left and right arrows go back and forward in it. """
+        obj = self.game
+        obj.renderer = renderer
+
+        tick_millis = 1000 / obj.tick_rate
+        seek_ticks = Playback.SEEK_SECONDS * obj.tick_rate
+
+        clock = pygame.time.Clock()
+        accumulator = 0.0
+        while True:
+            accumulator += clock.tick(60)
+
+            for event in pygame.event.get():
+                if event.type == pygame.locals.QUIT:
+                    return
+
+                renderer.process_event(event)
+                if event.type == pygame.locals.KEYDOWN:
+                    if event.key == pygame.locals.K_LEFT:
+                        self.seek(self.tick - seek_ticks)
+                    elif event.key == pygame.locals.K_RIGHT:
+                        self.seek(self.tick + seek_ticks)
+
+            while accumulator >= tick_millis:
+                self.advance()
+                accumulator -= tick_millis
+
+            renderer.render(obj, accumulator / tick_millis)
+
+def has_result(replay: Replay, obj: 'game.Game') -> bool:
+    """ Tells if the game ended with the result recorded in the replay. """
+    return obj.tick == replay.ticks and [player.score for player in obj.players] == replay.scores and checksum(obj) == replay.checksum
+
+def verify(replay: Replay) -> bool:
+    """ Simulates the replay again and tells if it has the result that was recorded. """
+    return has_result(replay, Playback(replay).run())
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks that a replay has the result it claims.")
+    parser.add_argument('path')
+    args = parser.parse_args()
+
+    game.player.init()
+    replay = load_replay(args.path)
+    obj = Playback(replay).run()
+
+    scores = [player.score for player in obj.players]
+    print(f"{game.utils.format_millis(obj.game_millis)}, scores {scores}: {'valid' if has_result(replay, obj) else 'INVALID'}")
+
+if __name__ == '__main__':
+    main()
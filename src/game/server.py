@@ -0,0 +1,271 @@
+""" Holds the authoritative multiplayer server: it runs a race headless, with the inputs of its clients,
+and sends them snapshots of the race over UDP (see game.protocol for the messages) """
+
+import argparse
+import asyncio
+from typing import Dict, List, Tuple, Union
+
+from pygame import Vector2
+
+import game
+import game.player
+import game.protocol as protocol
+from game.config import WorldConfig
+from game.landscape import LocalLandscape
+from game.pool import PlayerPool, PooledPlayer
+from game.protocol import Input, PlayerState, Snapshot
+
+Address = Tuple[str, int]
+
+class NetworkPlayer(PooledPlayer):
+    """ A player driven by the inputs its client sends, instead of a keyboard.
+    Every player of a server lives in its pool, so that the race is simulated all at once. """
+    uses_keyboard = False
+
+class Client:
+    def __init__(self, address: Address, id: int, player: NetworkPlayer, time: float):
+        self.address = address
+        self.id = id
+        self.player = player
+
+        # The inputs that were received but not applied yet, sorted by sequence
+        self.inputs: List[Input] = []
+        self.last_sequence = 0
+
+        # The last snapshot the client received, the next ones are encoded against it
+        self.ack: Union[int, None] = None
+        self.last_heard = time
+
+class GameServer(asyncio.DatagramProtocol):
+    """ Runs the race and owns its state. The clients only send their inputs, which are applied
+    at the tick they were made for (or as soon as possible, if they arrive late), one per tick. """
+
+    TICK_RATE = 60
+    SNAPSHOT_INTERVAL = 1
+    MAX_PLAYERS = 64
+    MAX_CATCH_UP_STEPS = 5
+
+    # Snapshots older than this (in ticks) can't be used as baselines anymore
+    HISTORY = 64
+    MAX_PENDING_INPUTS = 64
+
+    # Clients that aren't heard from for this long (in seconds) are removed
+    TIMEOUT = 5
+    def __init__(self, world: WorldConfig, seed: Union[int, str], tick_rate: int = TICK_RATE, snapshot_interval: int = SNAPSHOT_INTERVAL, max_players: int = MAX_PLAYERS):
+        assert tick_rate > 0
+        assert snapshot_interval > 0
+        assert max_players > 0
+
+        self.world = world
+        self.seed = seed
+        self.tick_rate = tick_rate
+        self.snapshot_interval = snapshot_interval
+        self.max_players = max_players
+
+        self.landscape = LocalLandscape(world, seed)
+        self.game = game.Game(None, self.landscape, tick_rate=tick_rate)
+        self.pool = PlayerPool(self.landscape, max_players)
+        self.tick = 0
+        self.running = True
+
+        self.clients: Dict[Address, Client] = {}
+        self.next_id = 0
+
+        self.history: Dict[int, Snapshot] = {}
+        self.last_snapshot: Union[Snapshot, None] = None
+
+        self.transport: Union[asyncio.DatagramTransport, None] = None
+        self.time = 0.0
+
+    async def listen(self, host: str = '127.0.0.1', port: int = 0) -> Address:
+        """ Starts receiving datagrams, returns the address the server is bound to. """
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(host, port))
+
+        assert self.transport is not None
+        return self.transport.get_extra_info('sockname')[:2]
+
+    async def run(self):
+        """ Runs the race until it ends or the server is closed. """
+        loop = asyncio.get_running_loop()
+        tick_seconds = 1 / self.tick_rate
+        next_time = loop.time()
+
+        while self.running:
+            self.time = loop.time()
+
+            steps = 0
+            while self.running and self.time >= next_time and steps < GameServer.MAX_CATCH_UP_STEPS:
+                self.step()
+                next_time += tick_seconds
+                steps += 1
+
+            # If we can't keep up, the race slows down instead of piling up steps
+            next_time = max(next_time, self.time - tick_seconds)
+
+            self.remove_silent_clients()
+            await asyncio.sleep(max(next_time - loop.time(), 0))
+
+    def close(self):
+        self.running = False
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def step(self):
+        """ Applies the inputs of the current tick, advances the race by a tick and sends the snapshot, when it is time to. """
+        inputs = {}
+        for client in self.clients.values():
+            if client.inputs and client.inputs[0][1] <= self.tick:
+                sequence, _, direction = client.inputs.pop(0)
+                inputs[client.player.uuid] = direction
+                client.last_sequence = sequence
+
+        ended = not self.game.step(1000 / self.tick_rate * self.world.time_factor, inputs)
+        self.tick += 1
+
+        if ended:
+            self.running = False
+
+        if ended or self.tick % self.snapshot_interval == 0:
+            self.broadcast(ended)
+
+    def broadcast(self, ended: bool = False):
+        snapshot = Snapshot(
+            self.tick,
+            {client.id: PlayerState.capture(client.player) for client in self.clients.values()},
+            {client.id: client.player.uuid for client in self.clients.values()},
+            ended
+        )
+
+        self.history[self.tick] = snapshot
+        self.history.pop(self.tick - GameServer.HISTORY * self.snapshot_interval, None)
+        self.last_snapshot = snapshot
+
+        # Most clients received the same snapshots, so the bodies are shared by baseline
+        bodies: Dict[Union[int, None], bytes] = {}
+        for client in self.clients.values():
+            self.send_snapshot(client, snapshot, bodies)
+
+    def send_snapshot(self, client: Client, snapshot: Snapshot, bodies: Union[Dict[Union[int, None], bytes], None] = None):
+        baseline = self.history.get(client.ack) if client.ack is not None else None
+        key = baseline.tick if baseline is not None else None
+
+        body = bodies.get(key) if bodies is not None else None
+        if body is None:
+            body = protocol.encode_snapshot_body(snapshot, baseline)
+            if bodies is not None:
+                bodies[key] = body
+
+        self.send(protocol.encode_snapshot(snapshot, baseline, client.last_sequence, body), client.address)
+
+    def send(self, data: bytes, address: Address):
+        if self.transport is not None:
+            self.transport.sendto(data, address)
+
+    def connection_made(self, transport):
+        self.transport = transport # type: ignore
+
+    def datagram_received(self, data: bytes, address: Address):
+        self.time = asyncio.get_running_loop().time()
+        try:
+            self.receive(data, address)
+        except (IndexError, ValueError):
+            pass # Malformed datagrams are dropped
+
+    def receive(self, data: bytes, address: Address):
+        kind = data[0]
+        client = self.clients.get(address)
+        if client is not None:
+            client.last_heard = self.time
+
+        if kind == protocol.JOIN:
+            if data[1] != protocol.VERSION:
+                return
+
+            if client is None:
+                if len(self.clients) >= self.max_players or not self.running:
+                    self.send(protocol.encode_reject(), address)
+                    return
+
+                client = self.add_client(address)
+
+            # Sent again if the client didn't get the first one
+            self.send(protocol.encode_welcome(client.id, client.player.uuid, self.tick_rate, self.seed, self.world.params), address)
+
+        elif kind == protocol.INPUT and client is not None:
+            ack, inputs = protocol.decode_input(data)
+            if ack is not None and ack in self.history:
+                client.ack = ack
+
+            last = client.inputs[-1][0] if client.inputs else client.last_sequence
+            for input in inputs:
+                if input[0] > last and len(client.inputs) < GameServer.MAX_PENDING_INPUTS:
+                    client.inputs.append(input)
+                    last = input[0]
+
+            # After the race, the clients that ask for it get the final snapshot
+            if not self.running and self.last_snapshot is not None and client.ack != self.last_snapshot.tick:
+                self.send_snapshot(client, self.last_snapshot)
+
+        elif kind == protocol.LEAVE and client is not None:
+            self.remove_client(client)
+
+    def add_client(self, address: Address) -> Client:
+        # The ids are never reused, so that a new player can't be mistaken for an old one in a baseline
+        player = NetworkPlayer(self.pool, Vector2(self.world.width / 2, 0), Vector2(0, 0))
+        client = Client(address, self.next_id, player, self.time)
+        self.next_id += 1
+
+        self.clients[address] = client
+        self.game.add_player(player)
+        return client
+
+    def remove_client(self, client: Client):
+        del self.clients[client.address]
+        self.game.remove_player(client.player.uuid)
+
+    def remove_silent_clients(self):
+        for client in list(self.clients.values()):
+            if self.time - client.last_heard > GameServer.TIMEOUT:
+                self.remove_client(client)
+
+async def serve(world: WorldConfig, seed: Union[int, str], host: str = '127.0.0.1', port: int = 0, **kwargs):
+    """ Runs a server for a single race. """
+    server = GameServer(world, seed, **kwargs)
+    await server.listen(host, port)
+    try:
+        await server.run()
+    finally:
+        server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a race that skiers can join over the network.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--seed', default='skiing')
+    parser.add_argument('--flags', type=int, default=20)
+    parser.add_argument('--trees', type=int, default=40)
+    parser.add_argument('--players', type=int, default=GameServer.MAX_PLAYERS)
+    args = parser.parse_args()
+
+    world = WorldConfig.builder() \
+        .set_width(800) \
+        .set_difficulty(1) \
+        .set_gravity(100) \
+        .set_inclination(60) \
+        .set_friction(0.4) \
+        .set_flags_start(300) \
+        .set_distance_between_flags(200) \
+        .set_flags_margin_horizontal(100) \
+        .set_flags_margin_vertical(250) \
+        .set_trees_margin_to_flags(100) \
+        .set_flags_ammount(args.flags) \
+        .set_trees_ammount(args.trees) \
+        .build()
+
+    game.player.init()
+    asyncio.run(serve(world, args.seed, args.host, args.port, max_players=args.players))
+
+if __name__ == '__main__':
+    main()
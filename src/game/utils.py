@@ -1,4 +1,5 @@
 import time
+from typing import Tuple
 
 def current_millis():
     return time.time() * 1000
@@ -12,4 +13,34 @@ def format_millis(millis: float) -> str:
     millis -= mins * 60
 
     rep = f"{mins}:" + f"{millis:.2f}".zfill(5)
-    return str(rep)
\ No newline at end of file
+    return str(rep)
+
+def write_varint(buffer: bytearray, value: int):
+    """ Appends a non-negative integer to the buffer, 7 bits per byte (LEB128), so that small numbers take a single byte. """
+    assert value >= 0
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    buffer.append(value)
+
+def read_varint(data, offset: int) -> Tuple[int, int]:
+    """ Reads an integer written with write_varint, returns it and the offset after it. """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+
+        shift += 7
+
+def zigzag(value: int) -> int:
+    """ Maps integers to non-negative integers (0, -1, 1, -2, ... to 0, 1, 2, 3, ...), so that small negative numbers are small varints too. """
+    return 2 * value if value >= 0 else -2 * value - 1
+
+def unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
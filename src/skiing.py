@@ -3,6 +3,10 @@
 @author: limwa
 """
 
+import argparse
+import asyncio
+import random
+
 import pygame
 import pygame.locals
 import pygame.display
@@ -12,16 +16,42 @@ import pygame.draw
 from pygame import Vector2
 
 import game
+import game.assets
+import game.bots
+import game.client
 import game.player
+import game.replay
 import game.camera
 import game.landscape
 import game.rendering
 from game.config import WorldConfig
+from game.profiler import profiler
 
 
 # GAME LOGIC
+async def play_online(screen, address: str) -> bool:
+    """ Joins the race of a server (see game.server) at address, given as host:port. """
+    host, port = address.rsplit(':', 1)
+
+    client = game.client.GameClient(game.player.get_keyboard())
+    await client.connect((host, int(port)))
+
+    renderer = game.rendering.Renderer(screen)
+    try:
+        return await client.run(renderer)
+    finally:
+        client.close()
+
 def main():
     """ Handles the game startup. """
+    parser = argparse.ArgumentParser(description="Skiing, an adaptation of the Atari 2600 game.")
+    parser.add_argument('--connect', metavar='HOST:PORT', help="joins a race of a server, instead of playing locally")
+    parser.add_argument('--record', metavar='PATH', help="saves a replay of the race")
+    parser.add_argument('--replay', metavar='PATH', help="shows a replay (the arrows go back and forward), instead of playing")
+    parser.add_argument('--players', type=int, default=1, choices=range(1, len(game.player.KEYBOARDS) + 1), help="how many players share this computer, on a split screen")
+    parser.add_argument('--bots', type=int, default=0, help="how many bots race against you")
+    parser.add_argument('--profile', metavar='PATH', help="saves how long every frame took, as CSV (.csv) or JSON (F3 shows it)")
+    args = parser.parse_args()
 
     config = WorldConfig.builder() \
         .set_width(800) \
@@ -41,20 +71,53 @@ def main():
     pygame.init()
     assert pygame.get_init(), "Pygame could not be initialized."
 
+    # The assets are decoded while the window is being created
+    game.assets.preload()
+
     screen = pygame.display.set_mode((800, 600))
     pygame.display.set_caption('Skiing')
 
     game.player.init()
 
-    renderer = game.rendering.Renderer(screen)
-    landscape = game.landscape.LocalLandscape(config)
+    if args.connect is not None:
+        asyncio.run(play_online(screen, args.connect))
+        pygame.quit()
+        return
+
+    renderer = game.rendering.Renderer(screen) if args.players == 1 else game.rendering.SplitScreenRenderer(screen, args.players)
+
+    if args.replay is not None:
+        game.replay.Playback(game.replay.load_replay(args.replay)).start(renderer)
+        pygame.quit()
+        return
+
+    # The seed is what the replays use to generate the landscape again
+    landscape = game.landscape.LocalLandscape(config, random.randrange(2 ** 32))
     player = game.player.Player(landscape, Vector2(config.width / 2, 0), Vector2(0, 0))
 
     current_game = game.Game(renderer, landscape, player)
-    # player2 = game.player.Player(landscape, Vector2(0, 0), Vector2(0, 0))
-    # current_game.add_player(player2)
+
+    # Every other local player takes the next keyboard (see game.player.KEYBOARDS)
+    for i in range(1, args.players):
+        current_game.add_player(game.player.Player(landscape, Vector2(config.width * (i + 1) / (args.players + 1), 0), Vector2(0, 0)))
+
+    for i in range(args.bots):
+        x = random.uniform(config.width / 4, config.width * 3 / 4)
+        current_game.add_player(game.player.Player(landscape, Vector2(x, 0), Vector2(0, 0), controller=game.bots.BotController(seed=i)))
+    replay = game.replay.Replay.of(current_game) if args.record is not None else None
+
+    if args.profile is not None:
+        profiler.start_trace()
+
     ended_successfuly = current_game.start()
 
+    if args.profile is not None:
+        profiler.save_trace(args.profile)
+
+    if ended_successfuly and replay is not None:
+        replay.finish(current_game)
+        replay.save(args.record)
+
     if ended_successfuly:
         current_game.game_millis += (config.flags_ammount - current_game.get_main_player().score) * 5000000 * config.time_factor
 